@@ -1,5 +1,7 @@
 import argparse
+import os
 from multiprocessing import set_start_method
+from pathlib import Path
 import isopredict.graph
 import isopredict.strategy
 import isopredict.benchmark
@@ -7,7 +9,8 @@ import isopredict.datastore as datastore
 import isopredict.verify as verify
 import isopredict.analysis as predictive
 import isopredict.stats as stats
-from isopredict.strategy import Strategy, Consistency, EnumAction
+import isopredict.tracefile as tracefile
+from isopredict.strategy import Strategy, Consistency, Encoding, Acyclicity, EnumAction
 
 def main():
     parser = argparse.ArgumentParser(description='Predicts unserializable behaviors that conforms to a weak isolation level')
@@ -16,14 +19,24 @@ def main():
     parser.add_argument('-s', '--stat', action='store_true', help='show statistics of observed execution')
     parser.add_argument('-d', '--debug', action='store_true', help='print debug info to files')
     parser.add_argument('-b', '--bound', help='max distance between predicted write and observed write')
+    parser.add_argument('--deepen', action='store_true', help='grow the bound from 1 until a prediction is found, up to the max distance')
     parser.add_argument('-v', '--visualize', action='store_true', help='visualize commit order')
     parser.add_argument('-l', '--level', type=Consistency, action=EnumAction, help='weak isolation level')
     parser.add_argument('-t', '--tactic', type=Strategy, action=EnumAction, help='strategy of predictive analysis')
+    parser.add_argument('-e', '--encoding', type=Encoding, action=EnumAction, help='encoding of relations between transactions')
+    parser.add_argument('-a', '--acyclicity', type=Acyclicity, action=EnumAction, help='encoding of the acyclic commit order of the weak isolation level')
     parser.add_argument('-o', '--output', type=str, help='Location of outputs')
+    parser.add_argument('--portfolio', type=int, default=1, metavar='N', help='race this many solver configurations in separate processes')
+    parser.add_argument('--cubes', type=int, default=1, metavar='N', help='split the prediction into cubes over session boundaries, solved by N processes')
+    parser.add_argument('--cube-choices', action='store_true', help='also split cubes over the write-read choices on the boundaries')
+    parser.add_argument('--decompose', type=int, default=0, metavar='N', help='solve the components of the trace that share no keys separately, in N processes')
+    parser.add_argument('-r', '--reduce', action='store_true', help='leave out the keys and transactions that no prediction can change')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes used to parse large text traces')
+    parser.add_argument('--no-cache', action='store_true', help='always parse the trace instead of using the parsed-trace cache')
     args = parser.parse_args()
 
     filename = args.filepath
-    db = datastore.parse_log(filename)
+    db = datastore.parse_log(filename, jobs=args.jobs, use_cache=not args.no_cache)
     if db is None:
         return
 
@@ -34,18 +47,60 @@ def main():
     vis = args.visualize
     tactic = args.tactic if args.tactic is not None else Strategy.Full
     level = args.level if args.level is not None else Consistency.Causal
+    encoding = args.encoding if args.encoding is not None else Encoding.Dense
+    acyclicity = args.acyclicity if args.acyclicity is not None else Acyclicity.Arithmetic
     debug = args.debug
 
+    error = parallel_error(args, acyclicity)
+    if error is not None:
+        print("[Error] %s"%error)
+        return
 
     if stats:
         db.show_stats()
     else:
         if check:
-            verifier = verify.Verifier(db, visualize=vis, debug=debug, consistency=level, output=output)
+            # the visualization and debug outputs come from a model of the encoding
+            if vis or debug:
+                verifier = verify.Verifier(db, visualize=vis, debug=debug, consistency=level, output=output, encoding=encoding)
+            else:
+                verifier = verify.ConcreteChecker(db, consistency=level)
             verifier.verify()
         else:
-            analysis = predictive.Analysis(db, bound=bound, visualize=vis, strategy=tactic, debug=debug, consistency=level, output=output)
-            analysis.predict()
+            if args.reduce:
+                db = db.reduce()
+                db.show_reduction()
+
+            options = dict(bound=bound, visualize=vis, strategy=tactic, debug=debug, consistency=level, output=output, encoding=encoding, acyclicity=acyclicity, portfolio=args.portfolio, cubes=args.cubes, cube_choices=args.cube_choices)
+            if args.decompose > 0:
+                predictive.Decomposition(db, workers=args.decompose, deepen=args.deepen, **options).predict()
+                return
+
+            analysis = predictive.Analysis(db, **options)
+            if args.deepen:
+                analysis.predict_deepening()
+            else:
+                analysis.predict()
+
+def parallel_error(args, acyclicity, mp=False):
+    # solver processes only receive serialized assertions, and benchmark processes cannot start them
+    if args.portfolio > 1 and args.cubes > 1:
+        return "--portfolio and --cubes cannot be combined"
+
+    if args.portfolio > 1 or args.cubes > 1:
+        if acyclicity == Acyclicity.Propagator:
+            return "--portfolio and --cubes require -a arithmetic, the propagator cannot be copied to other processes"
+
+        if mp:
+            return "--portfolio and --cubes cannot be combined with -mp, benchmark processes cannot start solver processes"
+
+        if args.decompose > 1:
+            return "--portfolio and --cubes cannot be combined with --decompose N for N > 1, its processes cannot start solver processes"
+
+    if args.decompose > 1 and mp:
+        return "--decompose N for N > 1 cannot be combined with -mp, benchmark processes cannot start other processes"
+
+    return None
 
 def runbench():
     set_start_method("spawn")
@@ -54,8 +109,19 @@ def runbench():
     parser.add_argument('benchmarkdir')
     parser.add_argument('-l', '--level', type=Consistency, action=EnumAction, help='weak isolation level')
     parser.add_argument('-t', '--tactic', type=Strategy, action=EnumAction, help='strategy of predictive analysis')
+    parser.add_argument('-e', '--encoding', type=Encoding, action=EnumAction, help='encoding of relations between transactions')
+    parser.add_argument('-a', '--acyclicity', type=Acyclicity, action=EnumAction, help='encoding of the acyclic commit order of the weak isolation level')
+    parser.add_argument('-b', '--bound', type=int, help='max distance between predicted write and observed write, all transactions by default')
+    parser.add_argument('--deepen', action='store_true', help='grow the bound from 1 until a prediction is found, up to the max distance')
     parser.add_argument('-o', '--output', type=str, help='Location of outputs')
+    parser.add_argument('--portfolio', type=int, default=1, metavar='N', help='race this many solver configurations in separate processes')
+    parser.add_argument('--cubes', type=int, default=1, metavar='N', help='split the prediction into cubes over session boundaries, solved by N processes')
+    parser.add_argument('--cube-choices', action='store_true', help='also split cubes over the write-read choices on the boundaries')
+    parser.add_argument('--decompose', type=int, default=0, metavar='N', help='solve the components of the trace that share no keys separately, in N processes')
+    parser.add_argument('-r', '--reduce', action='store_true', help='leave out the keys and transactions that no prediction can change')
     parser.add_argument('-mp', '--multi', action='store_true', help='enable parallel benchmark runs through multi-processing, might hang when running from Docker')
+    parser.add_argument('--no-cache', action='store_true', help='always parse traces instead of using the parsed-trace cache')
+    parser.add_argument('--matrix', action='store_true', help='run every level and tactic, or the given ones, encoding each trace once')
     
     args = parser.parse_args()
     dir = args.benchmarkdir
@@ -63,20 +129,63 @@ def runbench():
     output = args.output if args.output is not None else "out"
     mp = args.multi
     tactic = args.tactic
+    encoding = args.encoding if args.encoding is not None else Encoding.Dense
+    acyclicity = args.acyclicity if args.acyclicity is not None else Acyclicity.Arithmetic
+
+    error = parallel_error(args, acyclicity, mp)
+    if error is not None:
+        print("[Error] %s"%error)
+        return
+
+    if args.matrix:
+        if args.deepen:
+            print("[Error] --deepen cannot be combined with --matrix, every bound needs an encoding of its own")
+            return
+
+        if args.decompose > 0:
+            print("[Error] --decompose cannot be combined with --matrix, every component needs an encoding of its own")
+            return
+
+        levels = [args.level] if args.level is not None else list(Consistency)
+        tactics = [tactic] if tactic is not None else list(Strategy)
+        isopredict.benchmark.run_matrix_benchmarks(tactics, levels, dir, output=output, mp=mp, use_cache=not args.no_cache, encoding=encoding, acyclicity=acyclicity, portfolio=args.portfolio, cubes=args.cubes, cube_choices=args.cube_choices, bound=args.bound, reduce=args.reduce)
+        return
 
     if tactic is None:
         tactic = Strategy.Full
 
-    isopredict.benchmark.run_benchmarks(tactic, level, dir, output=output, mp=mp)
+    isopredict.benchmark.run_benchmarks(tactic, level, dir, output=output, mp=mp, use_cache=not args.no_cache, encoding=encoding, acyclicity=acyclicity, portfolio=args.portfolio, cubes=args.cubes, cube_choices=args.cube_choices, bound=args.bound, deepen=args.deepen, decompose=args.decompose, reduce=args.reduce)
 
 def benchstats():
     parser = argparse.ArgumentParser(description='IsoBench Statistics Collector')
     parser.add_argument('filepath')
     parser.add_argument('-o', '--output', type=str, help='Location of outputs')
+    parser.add_argument('--baseline', type=str, help='statistics of a run without --reduce, to report the speedup of every benchmark')
 
     args = parser.parse_args()
     filepath = args.filepath
     output = args.output if args.output is not None else "."
 
     data = stats.Stats(filepath, output)
-    data.print_summary()
\ No newline at end of file
+    data.print_summary()
+    if args.baseline is not None:
+        data.print_speedup(args.baseline)
+
+def convert():
+    parser = argparse.ArgumentParser(description='Converts text traces into the binary trace format')
+    parser.add_argument('filepath', nargs='+')
+    parser.add_argument('-o', '--output', type=str, help='Location of outputs')
+
+    args = parser.parse_args()
+
+    for filename in args.filepath:
+        name = filename.split("/")[-1].split(".")[0]
+        output = args.output if args.output is not None else os.path.dirname(filename)
+        if output:
+            Path(output).mkdir(parents=True, exist_ok=True)
+        out_file = os.path.join(output, name + tracefile.EXTENSION)
+
+        with open(filename) as f:
+            cnt = tracefile.write_log(out_file, datastore.tokenize_log(f))
+
+        print("Converted %s to %s: %d operations"%(filename, out_file, cnt))
@@ -1,23 +1,37 @@
+import contextlib
+import io
+import multiprocessing
 import time
 import random
+from pathlib import Path
 from z3 import *
 import isopredict.datastore as datastore
-from isopredict.strategy import Strategy, Consistency
+import isopredict.propagator as propagator
+import isopredict.portfolio as portfolio
+import isopredict.parallel as parallel
+from isopredict.strategy import Strategy, Consistency, Encoding, Acyclicity
 
 class Analysis(datastore.Symbolic):
-    def __init__(self, db, bound=10, visualize=False, debug=False, strategy=Strategy.Full, consistency=Consistency.Causal, output="./out"):
-        super().__init__(db, output)
+    def __init__(self, db, bound=None, visualize=False, debug=False, strategy=Strategy.Full, consistency=Consistency.Causal, output="./out", encoding=Encoding.Dense, acyclicity=Acyclicity.Arithmetic, portfolio=1, cubes=1, cube_choices=False):
+        super().__init__(db, output, encoding)
 
         # configurations
-        self.bound = self.db.transaction_count() if bound > db.transaction_count() else bound
+        self.bound = self.db.max_distance() if bound is None or bound > db.max_distance() else bound
         self.consistency = consistency
         self.debug = debug
         self.strategy = strategy
         self.visualize = visualize
+        self.acyclicity = acyclicity
+        self.portfolio = portfolio
+        self.cubes = cubes
+        self.cube_choices = cube_choices
 
         # statistics
         self.time_gencon = "N/A"
         self.time_solve = "N/A"
+        self.constraints = "N/A"
+        self.refinements = "N/A"
+        self.configuration = "N/A"
 
         # prediction boundary
         self.boundary = {session_id: Int("SessionBoundary[%s]"%session_id) for session_id in self.db.sessions.keys()}
@@ -30,6 +44,9 @@ class Analysis(datastore.Symbolic):
         # commit order from weak isolation level
         self.co_weak = None
 
+        # acyclicity propagator replacing co_weak, see weak_commit_order
+        self.weak_order = None
+
     def event_boundary_constraints(self):
         constraints = []
 
@@ -45,31 +62,36 @@ class Analysis(datastore.Symbolic):
         
         return And(constraints)
 
-    def causal_consistency_constraints(self):
-        co = self.create_commit_orders("Causal")
-        # total_tx = self.db.transaction_count()
-        constraints = [Distinct(list(co.values()))]
+    def weak_commit_order(self, consistency):
+        # returns the constraints defining a commit order, and a function stating that one transaction commits before another
+        if self.weak_order is not None:
+            return [], self.weak_order.edge
 
+        co = self.create_commit_orders(consistency)
         self.co_weak = co
 
+        return [Distinct(list(co.values()))], lambda tx1_id, tx2_id: co[tx1_id] < co[tx2_id]
+
+    def causal_consistency_constraints(self):
+        constraints, before = self.weak_commit_order("Causal")
+        # total_tx = self.db.transaction_count()
+
         # for c in co.values():
         #     constraints.append(And(c >= 0, c < total_tx))
 
-        for tx1_id, tx1 in self.tx.items():
-            for tx2_id, tx2 in self.tx.items():
-                if tx1_id == tx2_id:
-                    continue
+        if self.encoding == Encoding.Sparse:
+            pairs = self.related_pairs(self.wr, self.so, self.ar)
+        else:
+            pairs = self.all_pairs()
 
-                constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2), self.ar(tx1, tx2)),
-                                           co[tx1_id] < co[tx2_id]))
+        for tx1_id, tx2_id, tx1, tx2 in pairs:
+            constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2), self.ar(tx1, tx2)),
+                                       before(tx1_id, tx2_id)))
 
         return And(constraints)
     
     def read_committed_constraints(self):
-        co = self.create_commit_orders("ReadCommitted")
-        constraints = [Distinct(list(co.values()))]
-
-        self.co_weak = co
+        constraints, before = self.weak_commit_order("ReadCommitted")
 
         # read events of every transaction
         tx_reads = {}
@@ -113,6 +135,10 @@ class Analysis(datastore.Symbolic):
                     
                     # for all the events that reads k
                     for r1 in self.db.read_history[k]:
+                        # r1 reads from t1 neither as observed nor as predicted
+                        if not self.in_bound(t1, r1):
+                            continue
+
                         wrk_t1_r1 = [If(self.event_on_boundary_constraint(r1),
                                  And(self.choice[r1.key][(r1.transaction, r1.seq)] == pos, self.event_in_boundary_constraint(self.db.write_history[k][pos])),
                                  And(self.event_in_boundary_constraint(r1), r1.write_tx == t1, self.event_in_boundary_constraint(self.db.write_history[k][pos]))) 
@@ -121,7 +147,7 @@ class Analysis(datastore.Symbolic):
                         read_predecessors = [r for r in tx_reads[r1.transaction] if r.seq < r1.seq]
                         wr_t2_r2 = []
                         for r in read_predecessors:
-                            if (t2, r.key) not in tx_writes:
+                            if (t2, r.key) not in tx_writes or not self.in_bound(t2, r):
                                 continue
 
                             
@@ -131,20 +157,26 @@ class Analysis(datastore.Symbolic):
                                     for pos in tx_writes[(t2, r.key)]]
 
                         constraints.append(Implies(And(Or(wrk_t1_r1), Or(wr_t2_r2)), 
-                                                   co[t2] < co[t1]))
+                                                   before(t2, t1)))
             
         # preserving write-read and session-order
-        for tx1_id, tx1 in self.tx.items():
-            for tx2_id, tx2 in self.tx.items():
-                if tx1_id == tx2_id:
-                    continue
+        if self.encoding == Encoding.Sparse:
+            pairs = self.related_pairs(self.wr, self.so)
+        else:
+            pairs = self.all_pairs()
 
-                constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2)),
-                                        co[tx1_id] < co[tx2_id]))
+        for tx1_id, tx2_id, tx1, tx2 in pairs:
+            constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2)),
+                                    before(tx1_id, tx2_id)))
 
         return And(constraints)
     
     def unserializable_constraints_full(self):
+        co, serializable = self.serializable_constraints_full()
+
+        return Not(Exists(list(co.values()), serializable))
+
+    def serializable_constraints_full(self):
         # commit order
         co = self.create_commit_orders("Serializable")
         # total_tx = self.db.transaction_count()
@@ -162,37 +194,46 @@ class Analysis(datastore.Symbolic):
         #     constraints.append(And(c >= 0, c < total_tx))
 
         # prepare ww candidates
-        for tx1_id, tx1 in self.tx.items():
-            for tx2_id, tx2 in self.tx.items():
-                if tx1_id == tx2_id:
-                    continue
-
+        if self.encoding == Encoding.Sparse:
+            for tx1_id, tx2_id in self.ww.pairs:
                 ww = (tx1_id, tx2_id)
-
-                for k in wwk_candidates:
-                    if ww in wwk_candidates[k]:
+                for k, wwk_k in wwk_candidates.items():
+                    if ww in wwk_k:
                         if ww not in ww_candidates:
                             ww_candidates[ww] = []
-                        ww_candidates[ww] += wwk_candidates[k][ww]
+                        ww_candidates[ww] += wwk_k[ww]
 
-        # serializability constraint
-        for tx1_id, tx1 in self.tx.items():
-            for tx2_id, tx2 in self.tx.items():
-                if tx1_id == tx2_id:
-                    continue
+            pairs = self.related_pairs(self.wr, self.so, self.ww)
+        else:
+            for tx1_id, tx1 in self.tx.items():
+                for tx2_id, tx2 in self.tx.items():
+                    if tx1_id == tx2_id:
+                        continue
 
-                # serializable arbitration over k
-                ww = (tx1_id, tx2_id)
-                if ww in ww_candidates:
-                    # constraints.append(self.wwk[k](tx1, tx2) == Or(wwk_candidates[k][(tx1_id, tx2_id)]))
-                    constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2), Or(ww_candidates[ww])),
-                                                co[tx1_id] < co[tx2_id]))
-                else:
-                    # constraints.append(Not(self.wwk[k](tx1, tx2)))
-                    constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2)),
-                                                co[tx1_id] < co[tx2_id]))
+                    ww = (tx1_id, tx2_id)
 
-        return Not(Exists(list(co.values()), And(constraints)))
+                    for k in wwk_candidates:
+                        if ww in wwk_candidates[k]:
+                            if ww not in ww_candidates:
+                                ww_candidates[ww] = []
+                            ww_candidates[ww] += wwk_candidates[k][ww]
+
+            pairs = self.all_pairs()
+
+        # serializability constraint
+        for tx1_id, tx2_id, tx1, tx2 in pairs:
+            # serializable arbitration over k
+            ww = (tx1_id, tx2_id)
+            if ww in ww_candidates:
+                # constraints.append(self.wwk[k](tx1, tx2) == Or(wwk_candidates[k][(tx1_id, tx2_id)]))
+                constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2), Or(ww_candidates[ww])),
+                                            co[tx1_id] < co[tx2_id]))
+            else:
+                # constraints.append(Not(self.wwk[k](tx1, tx2)))
+                constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2)),
+                                            co[tx1_id] < co[tx2_id]))
+
+        return co, And(constraints)
     
     def unserializable_constraints_express(self):
         # constraints for unserializability
@@ -210,6 +251,8 @@ class Analysis(datastore.Symbolic):
         # reachability cycle constraints
         cycle = []
 
+        sparse = self.encoding == Encoding.Sparse
+
         # unserializability constraint
         for tx1_id, tx1 in self.tx.items():
             for tx2_id, tx2 in self.tx.items():
@@ -217,34 +260,39 @@ class Analysis(datastore.Symbolic):
                 constraints.append(And(self.rank(tx1, tx2) >= 0, self.rank(tx1, tx2) < total_tx * total_tx))
 
                 if tx1_id == tx2_id:
-                    constraints.append(Not(self.ww(tx1, tx2)))
-                    constraints.append(Not(self.rw(tx1, tx2)))
                     constraints.append(Not(self.reachable(tx1, tx2)))
-                    constraints.append(And(list(Not(wwx(tx1, tx2)) for wwx in self.wwk.values())))
-                    constraints.append(And(list(Not(rwx(tx1, tx2)) for rwx in self.rwk.values())))
+
+                    # sparse relations never relate a transaction to itself
+                    if not sparse:
+                        constraints.append(Not(self.ww(tx1, tx2)))
+                        constraints.append(Not(self.rw(tx1, tx2)))
+                        constraints.append(And(list(Not(wwx(tx1, tx2)) for wwx in self.wwk.values())))
+                        constraints.append(And(list(Not(rwx(tx1, tx2)) for rwx in self.rwk.values())))
                     continue
 
                 ww = (tx1_id, tx2_id)
 
-                # serializable arbitration over k
-                for k in wwk_candidates:
-                    if ww in wwk_candidates[k]:
-                        constraints.append(self.wwk[k](tx1, tx2) == Or(wwk_candidates[k][ww]))
-                    else:
-                        constraints.append(Not(self.wwk[k](tx1, tx2)))
+                # per-key relations of the sparse encoding are defined after the loop
+                if not sparse:
+                    # serializable arbitration over k
+                    for k in wwk_candidates:
+                        if ww in wwk_candidates[k]:
+                            constraints.append(self.wwk[k](tx1, tx2) == Or(wwk_candidates[k][ww]))
+                        else:
+                            constraints.append(Not(self.wwk[k](tx1, tx2)))
 
-                # serializable arbitration
-                constraints.append(self.ww(tx1, tx2) == Or(list(wwx(tx1, tx2) for wwx in self.wwk.values())))
+                    # serializable arbitration
+                    constraints.append(self.ww(tx1, tx2) == Or(list(wwx(tx1, tx2) for wwx in self.wwk.values())))
 
-                # serializable antidependency over k
-                for k in rwk_candidates:
-                    if ww in rwk_candidates[k]:
-                        constraints.append(self.rwk[k](tx1, tx2) == Or(rwk_candidates[k][ww]))
-                    else:
-                        constraints.append(Not(self.rwk[k](tx1, tx2)))
+                    # serializable antidependency over k
+                    for k in rwk_candidates:
+                        if ww in rwk_candidates[k]:
+                            constraints.append(self.rwk[k](tx1, tx2) == Or(rwk_candidates[k][ww]))
+                        else:
+                            constraints.append(Not(self.rwk[k](tx1, tx2)))
 
-                # serializable antidependency
-                constraints.append(self.rw(tx1, tx2) == Or(list(rwx(tx1, tx2) for rwx in self.rwk.values())))
+                    # serializable antidependency
+                    constraints.append(self.rw(tx1, tx2) == Or(list(rwx(tx1, tx2) for rwx in self.rwk.values())))
 
                 # reachability transitive closure
                 rch_constraints = [self.hb(tx1, tx2), self.ar(tx1, tx2), self.ww(tx1, tx2), self.rw(tx1, tx2)]
@@ -261,11 +309,120 @@ class Analysis(datastore.Symbolic):
                 # cycle constraint
                 cycle.append(And(self.reachable(tx1, tx2), self.reachable(tx2, tx1)))
         
+        # serializable arbitration and antidependency of the sparse encoding
+        if sparse:
+            for k in wwk_candidates:
+                constraints += self.sparse_constraints(self.wwk[k], wwk_candidates[k])
+            constraints += self.sparse_union_constraints(self.ww, self.wwk)
+
+            for k in rwk_candidates:
+                constraints += self.sparse_constraints(self.rwk[k], rwk_candidates[k])
+            constraints += self.sparse_union_constraints(self.rw, self.rwk)
+
         # cycle exists
         constraints.append(Or(cycle))
 
         return And(constraints)
     
+    def check(self, s):
+        # result of s and its model, raced by a portfolio of solver configurations when enabled;
+        # the portfolio only sees assertions, so it cannot check the propagator's acyclicity
+        if self.portfolio > 1 and self.weak_order is None:
+            res, m, winner = portfolio.check(s, self.portfolio)
+            self.configuration = portfolio.describe(winner) if winner is not None else "N/A"
+            return res, m
+
+        # cube-and-conquer over session boundaries, with the same restriction
+        if self.cubes > 1 and self.weak_order is None:
+            cubes = self.boundary_cubes(self.cubes * parallel.CUBES_PER_WORKER, self.cube_choices)
+            res, m, winner = parallel.check(s, cubes, self.cubes)
+            self.configuration = "cube %d of %d"%(winner + 1, len(cubes)) if winner is not None else "N/A"
+            return res, m
+
+        res = s.check()
+        return res, s.model() if res == sat else None
+
+    def boundary_cubes(self, limit, choices=False):
+        # splits the prediction into at most limit cubes, each fixing the boundaries of some sessions,
+        # and with choices, the write-read choices of the reads on those boundaries
+        reads = {(r.session, r.seq): r for read_history in self.db.read_history.values() for r in read_history}
+
+        # sessions with the most boundary candidates are split first
+        candidates = {}
+        for session_id in self.db.sessions.keys():
+            candidates[session_id] = [self.db.session_event_count[session_id] + 1]
+            if session_id in self.db.session_read_events:
+                candidates[session_id] += [seq + 1 for seq in self.db.session_read_events[session_id]]
+
+        # cubes are (constraints, reads on the boundaries) pairs
+        cubes = [([], [])]
+        for session_id in sorted(candidates, key=lambda s_id: len(candidates[s_id]), reverse=True):
+            if len(candidates[session_id]) < 2 or len(cubes) * len(candidates[session_id]) > limit:
+                continue
+
+            cubes = [(cube + [self.boundary[session_id] == b], on_boundary + [reads.get((session_id, b - 1))])
+                     for cube, on_boundary in cubes for b in candidates[session_id]]
+
+        # a read on the boundary chooses among the writes it may read from, see prediction_choice_constraints
+        depth = max(len(on_boundary) for _, on_boundary in cubes)
+        for i in range(depth if choices else 0):
+            split = []
+            for cube, on_boundary in cubes:
+                r = on_boundary[i]
+                if r is None:
+                    split.append((cube, on_boundary))
+                    continue
+
+                c = self.choice[r.key][(r.transaction, r.seq)]
+                split += [(cube + [c == j], on_boundary) for j in self.choice_candidates(r)]
+
+            if len(split) > limit:
+                break
+            cubes = split
+
+        return [cube for cube, _ in cubes]
+
+    def serializability_checker(self, co, serializable):
+        # solver for a serial commit order of a given prediction, and the symbols the prediction has to fix
+        checker = Solver()
+        checker.set("timeout", 3600000 * 2)
+        checker.add(serializable)
+
+        co_ids = {c.get_id() for c in co.values()}
+        symbols = [e for e in portfolio.uninterpreted_terms([serializable]) if e.get_id() not in co_ids]
+
+        return checker, symbols
+
+    def solve_unserializable_qf(self, s, co, serializable, checker, symbols):
+        # s proposes predictions; whenever a serial commit order of the prediction exists,
+        # s learns that this commit order does not serialize the next prediction
+        self.refinements = 0
+
+        while True:
+            res, m = self.check(s)
+            if res != sat:
+                return res, None
+
+            checker.push()
+            checker.add([x == m.eval(x, model_completion=True) for x in symbols])
+            witness = checker.check()
+
+            if witness != sat:
+                checker.pop()
+
+                # no serial commit order exists, the prediction is unserializable
+                if witness == unsat:
+                    return sat, m
+
+                return witness, None
+
+            w = checker.model()
+            serial_co = [(c, w.eval(c, model_completion=True)) for c in co.values()]
+            checker.pop()
+
+            s.add(Not(substitute(serializable, serial_co)))
+            self.refinements += 1
+
     def event_in_boundary_strict_constraint(self, event):
         return event.seq < self.boundary[event.session]
     
@@ -331,31 +488,70 @@ class Analysis(datastore.Symbolic):
         
         return so_candidates
     
+    def prepare_hb_edges(self, so_candidates):
+        # so and wr edges that exist in every prediction, and those that might exist
+        must = {pair: True for pair in so_candidates if pair[0] != pair[1]}
+        may = dict(must)
+
+        # no session boundary is below the smallest of its candidates, see event_boundary_constraints
+        min_boundary = {}
+        for session_id in self.db.sessions.keys():
+            read_events = self.db.session_read_events.get(session_id, [])
+            min_boundary[session_id] = min([self.db.session_event_count[session_id] + 1] + [seq + 1 for seq in read_events])
+
+        for k, read_history in self.db.read_history.items():
+            for read in read_history:
+                # reads that are never on the boundary keep reading from their observed write, see prepare_wrk_candidates
+                if self.strategy == Strategy.Relaxed:
+                    fixed = self.db.first_event_in_tx[read.transaction] + self.db.transaction_event_count[read.transaction] < min_boundary[read.session]
+                else:
+                    fixed = read.seq + 1 < min_boundary[read.session]
+
+                for write in self.db.write_history[k]:
+                    if write.transaction == read.transaction:
+                        continue
+
+                    wr = (write.transaction, read.transaction)
+                    if not fixed:
+                        if self.in_bound(write.transaction, read):
+                            may[wr] = True
+                    elif write.transaction == read.write_tx and write.seq == read.write_seq and write.session == read.write_session:
+                        must[wr] = True
+                        may[wr] = True
+
+        return list(must.keys()), list(may.keys())
+
     def prediction_choice_constraints(self):
         constraints = []
 
         for k, read_history in self.db.read_history.items():
             for r in read_history:
                 c = self.choice[k][(r.transaction, r.seq)]
-                choices = [And(c == i, self.event_in_boundary_constraint(self.db.write_history[k][i])) for i in range(len(self.db.write_history[k]))]
-                # constraints.append(And(c >= 0, c < len(self.db.write_history[k])))
+                choices = [And(c == i, self.event_in_boundary_constraint(self.db.write_history[k][i])) for i in self.choice_candidates(r)]
 
                 constraints.append(Or(choices))
+        
+        return And(constraints)
 
-                for i in range(len(self.db.write_history[k])):
-                    w = self.db.write_history[k][i]
+    def in_bound(self, tx_id, read):
+        # whether the read may read from a write of transaction tx_id, which is not too far away from the observed write of the read
+        return self.db.transaction_distance(tx_id, read.write_tx) <= self.bound
 
-                    # skip writes that come later in the same session
-                    if w.session == r.session and w.seq > r.seq:
-                        constraints.append(c != i)
-                        continue
+    def choice_candidates(self, r):
+        # indices of the writes that read r may choose
+        candidates = []
+        for i, w in enumerate(self.db.write_history[r.key]):
+            # skip writes that come later in the same session
+            if w.session == r.session and w.seq > r.seq:
+                continue
 
-                    # skip writes that are too far away from og_write
-                    # distance = self.db.transaction_distance(w.transaction, r.write_tx)
-                    # if distance > self.bound:
-                    #     constraints.append(c != i)
-        
-        return And(constraints)
+            # skip writes that are too far away from og_write
+            if not self.in_bound(w.transaction, r):
+                continue
+
+            candidates.append(i)
+
+        return candidates
     
     def prepare_wrk_candidates(self, key):
         wrk = self.wrk[key]
@@ -376,7 +572,7 @@ class Analysis(datastore.Symbolic):
             write = self.db.write_history[key][i]
 
             for read in self.db.read_history[key]:
-                if write.transaction == read.transaction:
+                if write.transaction == read.transaction or not self.in_bound(write.transaction, read):
                     continue
 
                 wr = (write.transaction, read.transaction)
@@ -427,7 +623,7 @@ class Analysis(datastore.Symbolic):
                                         self.tx_in_boundary_constraint(read.transaction),
                                         self.tx_in_boundary_constraint(write.transaction),
                                         wrk(self.tx[write.transaction], self.tx[read.transaction]),
-                                        self.hb(self.tx[conflict.transaction], self.tx[read.transaction])) for read in self.db.read_history[key])
+                                        self.hb(self.tx[conflict.transaction], self.tx[read.transaction])) for read in self.db.read_history[key] if self.in_bound(write.transaction, read))
                 
         return candidates
     
@@ -464,7 +660,7 @@ class Analysis(datastore.Symbolic):
                                         self.tx_in_boundary_constraint(read.transaction),
                                         self.tx_in_boundary_constraint(write.transaction),
                                         wrk(self.tx[write.transaction], self.tx[read.transaction]),
-                                        co[conflict.transaction] < co[read.transaction]) for read in self.db.read_history[key])
+                                        co[conflict.transaction] < co[read.transaction]) for read in self.db.read_history[key] if self.in_bound(write.transaction, read))
                 
         return candidates
     
@@ -502,7 +698,7 @@ class Analysis(datastore.Symbolic):
                                         self.tx_in_boundary_constraint(write.transaction),
                                         wrk(self.tx[write.transaction], self.tx[read.transaction]),
                                         self.rank(self.tx[conflict.transaction], self.tx[write.transaction]) > self.rank(self.tx[conflict.transaction], self.tx[read.transaction]),
-                                        self.reachable(self.tx[conflict.transaction], self.tx[read.transaction])) for read in self.db.read_history[key])
+                                        self.reachable(self.tx[conflict.transaction], self.tx[read.transaction])) for read in self.db.read_history[key] if self.in_bound(write.transaction, read))
                 
         return candidates
     
@@ -534,16 +730,12 @@ class Analysis(datastore.Symbolic):
                                         self.tx_in_boundary_constraint(write.transaction),
                                         wrk(self.tx[write.transaction], self.tx[read.transaction]),
                                         self.rank(self.tx[read.transaction], self.tx[conflict.transaction]) > self.rank(self.tx[write.transaction], self.tx[conflict.transaction]),
-                                        self.reachable(self.tx[write.transaction], self.tx[conflict.transaction])) for write in self.db.write_history[key])
+                                        self.reachable(self.tx[write.transaction], self.tx[conflict.transaction])) for write in self.db.write_history[key] if self.in_bound(write.transaction, read))
                 
         return candidates
     
-    def do_prediction(self):
-        s = Solver()
-        s.set("timeout", 3600000 * 2)
-
-        # start the clock
-        start = time.perf_counter()
+    def trace_constraints(self, s):
+        # encoding of the trace, shared by every weak isolation level and unserializability strategy
 
         # transaction constraints
         s.add(self.tx_constraints())
@@ -564,52 +756,73 @@ class Analysis(datastore.Symbolic):
         # ark constraints
         ark_candidates = {k: self.prepare_ark_candidates(k) for k in self.ark.keys()}
     
-        # so, wr, hb, ar constraints
-        for tx1_id, tx1 in self.tx.items():
-            for tx2_id, tx2 in self.tx.items():
-                if tx1_id == tx2_id:
-                    s.add(Not(self.so(tx1, tx2)))
-                    s.add(Not(self.wr(tx1, tx2)))
-                    s.add(Not(self.hb(tx1, tx2)))
-                    s.add(Not(self.ar(tx1, tx2)))
-                    s.add(And(list(Not(wrx(tx1, tx2)) for wrx in self.wrk.values())))
-                    s.add(And(list(Not(arx(tx1, tx2)) for arx in self.ark.values())))
-                    continue
+        # happens-before, symbolic only where it depends on the prediction
+        must_hb, may_hb = self.prepare_hb_edges(so_candidates)
+        s.add(self.bounded_hb_constraints(must_hb, may_hb))
+    
+        # so, wr, ar constraints
+        if self.encoding == Encoding.Sparse:
+            s.add(self.sparse_constraints(self.so, so_candidates, BoolVal))
+            for k in wrk_candidates:
+                s.add(self.sparse_constraints(self.wrk[k], wrk_candidates[k]))
+            s.add(self.sparse_union_constraints(self.wr, self.wrk))
+            for k in ark_candidates:
+                s.add(self.sparse_constraints(self.ark[k], ark_candidates[k]))
+            s.add(self.sparse_union_constraints(self.ar, self.ark))
+        else:
+            for tx1_id, tx1 in self.tx.items():
+                for tx2_id, tx2 in self.tx.items():
+                    if tx1_id == tx2_id:
+                        s.add(Not(self.so(tx1, tx2)))
+                        s.add(Not(self.wr(tx1, tx2)))
+                        s.add(Not(self.ar(tx1, tx2)))
+                        s.add(And(list(Not(wrx(tx1, tx2)) for wrx in self.wrk.values())))
+                        s.add(And(list(Not(arx(tx1, tx2)) for arx in self.ark.values())))
+                        continue
                 
-                # session order constraints
-                if (tx1_id, tx2_id) in so_candidates:
-                    s.add(self.so(tx1, tx2) == so_candidates[(tx1_id, tx2_id)])
-                else:
-                    s.add(Not(self.so(tx1, tx2)))
-
-                # write-read over k constraints
-                for k in wrk_candidates:
-                    if (tx1_id, tx2_id) in wrk_candidates[k]:
-                        s.add(self.wrk[k](tx1, tx2) == Or(wrk_candidates[k][(tx1_id, tx2_id)]))
+                    # session order constraints
+                    if (tx1_id, tx2_id) in so_candidates:
+                        s.add(self.so(tx1, tx2) == so_candidates[(tx1_id, tx2_id)])
                     else:
-                        s.add(Not(self.wrk[k](tx1, tx2)))
+                        s.add(Not(self.so(tx1, tx2)))
+
+                    # write-read over k constraints
+                    for k in wrk_candidates:
+                        if (tx1_id, tx2_id) in wrk_candidates[k]:
+                            s.add(self.wrk[k](tx1, tx2) == Or(wrk_candidates[k][(tx1_id, tx2_id)]))
+                        else:
+                            s.add(Not(self.wrk[k](tx1, tx2)))
 
-                # write-read
-                s.add(self.wr(tx1, tx2) == Or(list(wrx(tx1, tx2) for wrx in self.wrk.values())))
+                    # write-read
+                    s.add(self.wr(tx1, tx2) == Or(list(wrx(tx1, tx2) for wrx in self.wrk.values())))
                 
-                # happens-before transitive closure
-                hb_constraints = [self.wr(tx1, tx2), self.so(tx1, tx2)]
+                    # causal arbitration over k
+                    for k in ark_candidates:
+                        if (tx1_id, tx2_id) in ark_candidates[k]:
+                            s.add(self.ark[k](tx1, tx2) == Or(ark_candidates[k][(tx1_id, tx2_id)]))
+                        else:
+                            s.add(Not(self.ark[k](tx1, tx2)))
 
-                for tx3_id, tx3 in self.tx.items():
-                    if tx3_id != tx1_id and tx3_id != tx2_id:
-                        hb_constraints.append(And(self.hb(tx1, tx3), Or(self.wr(tx3, tx2), self.so(tx3, tx2))))
+                    # causal arbitration
+                    s.add(self.ar(tx1, tx2) == Or(list(arx(tx1, tx2) for arx in self.ark.values())))
 
-                s.add(self.hb(tx1, tx2) == Or(hb_constraints))
+        # the propagator is attached to the solver once, queries register their own literals
+        if self.acyclicity == Acyclicity.Propagator:
+            self.weak_order = propagator.AcyclicityPropagator(s, self.tx.keys(), self.consistency.name)
 
-                # causal arbitration over k
-                for k in ark_candidates:
-                    if (tx1_id, tx2_id) in ark_candidates[k]:
-                        s.add(self.ark[k](tx1, tx2) == Or(ark_candidates[k][(tx1_id, tx2_id)]))
-                    else:
-                        s.add(Not(self.ark[k](tx1, tx2)))
+    def do_prediction(self, s=None, start=None):
+        # without a solver, the trace is encoded on a fresh one; otherwise s already holds it since start, see MultiQuery
+        if s is None:
+            s = Solver()
+            s.set("timeout", 3600000 * 2)
+
+            # start the clock
+            start = time.perf_counter()
+
+            self.trace_constraints(s)
 
-                # causal arbitration
-                s.add(self.ar(tx1, tx2) == Or(list(arx(tx1, tx2) for arx in self.ark.values())))
+        if self.weak_order is not None:
+            self.weak_order.reset(self.consistency.name)
 
         # constraints of a weak isolation level
         if self.consistency == Consistency.Causal:
@@ -622,6 +835,10 @@ class Analysis(datastore.Symbolic):
         # unserializability
         if self.strategy == Strategy.Full:
             s.add(self.unserializable_constraints_full())
+        elif self.strategy == Strategy.FullQF:
+            # checked by refinement instead of a quantifier, see solve_unserializable_qf
+            co, serializable = self.serializable_constraints_full()
+            checker, symbols = self.serializability_checker(co, serializable)
         else:
             s.add(self.unserializable_constraints_express())
 
@@ -629,26 +846,32 @@ class Analysis(datastore.Symbolic):
         time_gencon = time.perf_counter()
         self.time_gencon = "%.3f"%(time_gencon - start)
 
+        # number of constraints, not part of either time
+        self.constraints = self.constraint_count(s)
+        time_gencon = time.perf_counter()
+
         # solve
-        res = s.check()
+        if self.strategy == Strategy.FullQF:
+            res, m = self.solve_unserializable_qf(s, co, serializable, checker, symbols)
+        else:
+            res, m = self.check(s)
 
         # constraint solving time
         time_solve = time.perf_counter()
         self.time_solve = "%.3f"%(time_solve - time_gencon)
 
         print("Predictive: %s"%str(res))
+        if self.portfolio > 1 or self.cubes > 1:
+            print("Solver configuration: %s"%self.configuration)
 
         # print assertions
         if self.debug:
             self.print_assertions(s)
 
-        if res != sat:
-            return None, res
-        
-        return s.model(), res
+        return m, res
 
-    def predict(self):
-        m, res = self.do_prediction()
+    def predict(self, s=None, start=None):
+        m, res = self.do_prediction(s, start)
 
         if m is None:
             return res
@@ -670,6 +893,9 @@ class Analysis(datastore.Symbolic):
 
         # output file for the predicted history
         out_file = "%s/unserializable_history_%s.txt"%(self.out, self.db.in_file)
+
+        # the history is written over the trace a reduced trace comes from, see DataStore.reduce
+        trace = self.db.origin if self.db.origin is not None else self.db
         
         # print the borders
         print("Session Boundaries: ")
@@ -684,14 +910,25 @@ class Analysis(datastore.Symbolic):
                     boundary_tx.append(t_id)
                     break
 
+        # sessions left out by the reduction are not cut
+        for s_id in trace.sessions:
+            if s_id not in prediction_boundary:
+                prediction_boundary[s_id] = trace.session_event_count[s_id] + 1
+
         # concrete events from prediction
         tx_events = {}
 
         # predicted commit order of weak isolation level
-        co_weak = sorted([(t_id, m.evaluate(cc).as_long()) for t_id, cc in self.co_weak.items()], key=lambda x: x[1])
+        if self.weak_order is not None:
+            co_weak = self.weak_order.commit_order(m)
+        else:
+            co_weak = [t_id for t_id, _ in sorted([(t_id, m.evaluate(cc).as_long()) for t_id, cc in self.co_weak.items()], key=lambda x: x[1])]
 
         # observed commit order
-        observed_co = sorted([(t, co) for t, co in self.db.observed_co.items()], key=lambda x: x[1])
+        observed_co = sorted([(t, co) for t, co in trace.observed_co.items()], key=lambda x: x[1])
+
+        # transactions that happen after a boundary transaction are out of bound
+        out_of_bound = {t_id for t_id in trace.observed_co if t_id != datastore.FINAL_TX and any(self.happens_before(m, b_id, t_id) for b_id in boundary_tx)}
 
         # predicted transaction commit order
         tx_order = []
@@ -707,21 +944,14 @@ class Analysis(datastore.Symbolic):
             if t_id in boundary_tx:
                 continue
 
-            out_of_bound = False
-
             # exclude out-of-bound transactions
-            for b_id in boundary_tx:
-                hb = m.evaluate(self.hb(self.tx[b_id], self.tx[t_id]))
-                if is_true(hb):
-                    out_of_bound = True
-
-            if out_of_bound:
+            if t_id in out_of_bound:
                 continue
 
             tx_order.append(t_id)
         
         # boundary transactions follow the weak isolation commit order
-        for t_id, i in co_weak:
+        for t_id in co_weak:
             # skip non-boundary transactions
             if t_id not in boundary_tx:
                 continue
@@ -730,16 +960,24 @@ class Analysis(datastore.Symbolic):
             
 
         # add read events to tx_events
-        for k, events in self.db.read_history.items():
+        for k, events in trace.read_history.items():
             for r in events:
                 # for reads that are beyond the prediction border, ignore them
                 if self.strategy == Strategy.Relaxed:
-                    if self.db.first_event_in_tx[r.transaction] >= prediction_boundary[r.session]:
+                    if trace.first_event_in_tx[r.transaction] >= prediction_boundary[r.session]:
                         continue
                 else:
                     if r.seq >= prediction_boundary[r.session]:
                         continue
 
+                # reads of keys left out by the reduction read from their original writes
+                if k not in self.choice:
+                    if r.transaction not in tx_events:
+                        tx_events[r.transaction] = []
+                    tx_events[r.transaction].append(r)
+
+                    continue
+
                 # for reads that are not on the prediction border, they read from original writes
                 if self.strategy == Strategy.Relaxed:
                     if self.db.first_event_in_tx[r.transaction] + self.db.transaction_event_count[r.transaction] < prediction_boundary[r.session]:
@@ -772,11 +1010,11 @@ class Analysis(datastore.Symbolic):
                 predicted_wr.append((k, r, write, datastore.Write(r.write_session, r.write_tx, r.write_seq, r.key)))
 
         # add write events to tx_events
-        for k, events in self.db.write_history.items():
+        for k, events in trace.write_history.items():
             for e in events:
                 # check whether event is out of bound
                 if self.strategy == Strategy.Relaxed:
-                    if self.db.first_event_in_tx[e.transaction] >= prediction_boundary[e.session]:
+                    if trace.first_event_in_tx[e.transaction] >= prediction_boundary[e.session]:
                         continue
                 else:
                     if e.seq >= prediction_boundary[e.session]:
@@ -797,15 +1035,8 @@ class Analysis(datastore.Symbolic):
                 if t_id == datastore.FINAL_TX:
                     continue
 
-                out_of_bound = False
-                
                 # exclude out-of-bound transactions
-                for b_id in boundary_tx:
-                    hb = m.evaluate(self.hb(self.tx[b_id], self.tx[t_id]))
-                    if is_true(hb):
-                        out_of_bound = True
-
-                if out_of_bound:
+                if t_id in out_of_bound:
                     continue
 
                 for e in sorted(tx_events[t_id], key=lambda ev: ev.seq):
@@ -831,4 +1062,167 @@ class Analysis(datastore.Symbolic):
                 ))
 
         return res
+
+    def happens_before(self, m, tx1_id, tx2_id):
+        # whether tx1 happens before tx2 in model m; a transaction collapsed by the reduction
+        # happens after exactly what its closest remaining predecessor in session order happens after
+        if tx2_id in self.db.collapsed:
+            tx2_id = self.db.collapsed[tx2_id]
+            if tx1_id == tx2_id:
+                return True
+
+        return self.model_relation(m, self.hb)(tx1_id, tx2_id)
+
+    def predict_deepening(self):
+        # predicts with a bound doubling from 1 until a prediction is found or the bound reaches self.bound,
+        # an unsat below the full bound only rules out predictions reading from writes that close to the observed ones
+        max_bound = self.bound
+        bound = min(1, max_bound)
+        time_gencon = 0
+        time_solve = 0
+
+        while True:
+            self.bound = bound
+            print("Bound: %d/%d"%(bound, max_bound))
+            res = self.predict()
+
+            # statistics of every round
+            time_gencon += float(self.time_gencon)
+            time_solve += float(self.time_solve)
+
+            if res == sat or bound >= max_bound:
+                break
+            bound = min(bound * 2, max_bound)
+
+        self.time_gencon = "%.3f"%time_gencon
+        self.time_solve = "%.3f"%time_solve
+
+        return res
     
+
+class MultiQuery:
+    # predictions of several (consistency, strategy, output) queries on one trace, sharing the encoding of the trace on one solver
+    def __init__(self, db, queries, bound=None, encoding=Encoding.Dense, acyclicity=Acyclicity.Arithmetic, portfolio=1, cubes=1, cube_choices=False):
+        self.db = db
+        self.queries = list(queries)
+        self.bound = bound
+        self.encoding = encoding
+        self.acyclicity = acyclicity
+        self.portfolio = portfolio
+        self.cubes = cubes
+        self.cube_choices = cube_choices
+
+    def run(self):
+        # yields the level, strategy, analysis and result of every query, the analysis holds the statistics of the query
+        # relaxed boundaries change the encoding of the trace, so their queries share a solver of their own
+        groups = {}
+        for level, tactic, output in self.queries:
+            relaxed = tactic == Strategy.Relaxed
+            if relaxed not in groups:
+                groups[relaxed] = []
+            groups[relaxed].append((level, tactic, output))
+
+        for queries in groups.values():
+            level, tactic, output = queries[0]
+            analysis = Analysis(self.db, bound=self.bound, strategy=tactic, consistency=level, output=output, encoding=self.encoding, acyclicity=self.acyclicity, portfolio=self.portfolio, cubes=self.cubes, cube_choices=self.cube_choices)
+
+            s = Solver()
+            s.set("timeout", 3600000 * 2)
+
+            # the first query of a solver pays for the encoding of the trace
+            start = time.perf_counter()
+            analysis.trace_constraints(s)
+
+            for level, tactic, output in queries:
+                analysis.consistency = level
+                analysis.strategy = tactic
+                analysis.out = output
+                Path(output).mkdir(parents=True, exist_ok=True)
+
+                s.push()
+                res = analysis.predict(s, start)
+                s.pop()
+
+                yield level, tactic, analysis, res
+
+                start = time.perf_counter()
+
+def _predict_component(task):
+    # prediction on one component of a trace, with its printed output, see Decomposition
+    index, db, options, deepen = task
+    analysis = Analysis(db, **options)
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        res = analysis.predict_deepening() if deepen else analysis.predict()
+
+    return index, str(res), out.getvalue(), analysis.time_gencon, analysis.time_solve, analysis.constraints, analysis.configuration
+
+class Decomposition:
+    # prediction on the independent components of a trace, see DataStore.components; a prediction is unserializable
+    # exactly when its restriction to one of the components is, so the components are solved separately until one is sat
+    def __init__(self, db, workers=1, deepen=False, **options):
+        self.db = db
+        self.workers = workers
+        self.deepen = deepen
+        self.options = options
+
+        # statistics, summed over the solved components
+        self.time_gencon = "N/A"
+        self.time_solve = "N/A"
+        self.constraints = "N/A"
+        self.configuration = "N/A"
+
+    def predict(self):
+        # smaller components first, a trace of a single component keeps its name
+        components = self.db.components()
+        components.sort(key=lambda sessions: sum(len(self.db.sessions[s_id]) for s_id in sessions))
+        if len(components) == 1:
+            tasks = [(0, self.db, self.options, self.deepen)]
+        else:
+            tasks = [(i, self.db.restrict(sessions, "%s_component%d"%(self.db.in_file, i + 1)), self.options, self.deepen) for i, sessions in enumerate(components)]
+
+        print("Components: %d"%len(tasks))
+
+        if self.workers > 1 and len(tasks) > 1:
+            with multiprocessing.get_context("spawn").Pool(min(self.workers, len(tasks))) as pool:
+                # the remaining components are terminated with the pool
+                res = self.collect(pool.imap_unordered(_predict_component, tasks), len(tasks))
+        else:
+            res = self.collect(map(_predict_component, tasks), len(tasks))
+
+        return res
+
+    def collect(self, results, count):
+        # results of components until the first sat one, whose output is the output of the prediction
+        res = unsat
+        time_gencon = 0
+        time_solve = 0
+        constraints = 0
+
+        for index, verdict, output, gencon, solve, cnt, configuration in results:
+            time_gencon += float(gencon)
+            time_solve += float(solve)
+            constraints += cnt
+
+            if verdict == "sat":
+                res = sat
+                print("Component %d of %d"%(index + 1, count))
+                print(output, end="")
+                self.configuration = configuration if count == 1 else "component %d of %d"%(index + 1, count)
+                break
+
+            # one undecided component leaves the whole prediction undecided
+            if verdict != "unsat":
+                res = unknown
+                print("Component %d of %d"%(index + 1, count))
+                print(output, end="")
+
+        if res != sat:
+            print("Predictive: %s"%str(res))
+
+        self.time_gencon = "%.3f"%time_gencon
+        self.time_solve = "%.3f"%time_solve
+        self.constraints = constraints
+
+        return res
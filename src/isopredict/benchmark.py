@@ -2,6 +2,7 @@ import csv
 import functools
 import glob
 import multiprocessing
+import time
 from multiprocessing import set_start_method
 from pathlib import Path
 from tabulate import tabulate
@@ -9,27 +10,72 @@ from z3 import *
 import isopredict.datastore as datastore
 import isopredict.verify as verify
 import isopredict.analysis as predictive
-from isopredict.strategy import Consistency, Strategy, EnumAction
+import isopredict.tracefile as tracefile
+from isopredict.strategy import Consistency, Strategy, Encoding, Acyclicity, EnumAction
 
-def run(filename, level, tactic, output):
-    db = datastore.parse_log(filename)
+HEADERS = ["Benchmark", "Observed Execution", "Predicted Execution", "Constraint Generation", "Constraint Solving", "Total Events", "Total Transactions", "SMT Constraints", "Solver Configuration", "Reduced Events", "Reduced Transactions", "Trace Reduction"]
+
+def run(filename, level, tactic, output, use_cache=False, encoding=Encoding.Dense, acyclicity=Acyclicity.Arithmetic, portfolio=1, cubes=1, cube_choices=False, bound=None, deepen=False, decompose=0, reduce=False):
+    db = datastore.parse_log(filename, use_cache=use_cache)
     if db is None:
         return None
+
+    db, time_reduce = reduce_trace(db, reduce)
     
-    bound = 10
     # verifier = verify.Verifier(db, consistency=level, output=output)
-    analysis = predictive.Analysis(db, bound=bound, consistency=level, strategy=tactic, output=output)
+    options = dict(bound=bound, consistency=level, strategy=tactic, output=output, encoding=encoding, acyclicity=acyclicity, portfolio=portfolio, cubes=cubes, cube_choices=cube_choices)
 
     # serial = verifier.verify()
-    predicted = "N/A"
-    time_gencon = "N/A"
-    time_solve = "N/A"
-    transaction_cnt = "%d"%(db.transaction_count())
-    event_cnt = "%d"%(db.event_count())
+    if decompose > 0:
+        # the decomposition holds the statistics summed over its components
+        analysis = predictive.Decomposition(db, workers=decompose, deepen=deepen, **options)
+        predicted = analysis.predict()
+    else:
+        analysis = predictive.Analysis(db, **options)
+        if deepen:
+            predicted = analysis.predict_deepening()
+        else:
+            predicted = analysis.predict()
+
+    return record(db, analysis, predicted, level, tactic, output, time_reduce)
+
+def reduce_trace(db, reduce):
+    # the trace to predict on, and the time its reduction took
+    if not reduce:
+        return db, "N/A"
+
+    start = time.perf_counter()
+    db = db.reduce()
+    time_reduce = "%.3f"%(time.perf_counter() - start)
+    db.show_reduction()
+
+    return db, time_reduce
+
+def run_matrix(filename, queries, use_cache=False, encoding=Encoding.Dense, acyclicity=Acyclicity.Arithmetic, portfolio=1, cubes=1, cube_choices=False, bound=None, reduce=False):
+    # runs every (level, tactic, output) query on the trace, encoding the trace once per solver, see predictive.MultiQuery
+    db = datastore.parse_log(filename, use_cache=use_cache)
+    if db is None:
+        return None
+
+    db, time_reduce = reduce_trace(db, reduce)
+
+    results = {}
+    for level, tactic, analysis, predicted in predictive.MultiQuery(db, queries, bound=bound, encoding=encoding, acyclicity=acyclicity, portfolio=portfolio, cubes=cubes, cube_choices=cube_choices).run():
+        results[(level, tactic)] = record(db, analysis, predicted, level, tactic, analysis.out, time_reduce)
+
+    return results
+
+def record(db, analysis, predicted, level, tactic, output, time_reduce="N/A"):
+    # writes the csv of one prediction and returns its row, the counts are those of the trace a reduced trace comes from
+    trace = db.origin if db.origin is not None else db
+    transaction_cnt = "%d"%(trace.transaction_count())
+    event_cnt = "%d"%(trace.event_count())
+    reduced_transaction_cnt = "%d"%(db.transaction_count()) if db.origin is not None else "N/A"
+    reduced_event_cnt = "%d"%(db.event_count()) if db.origin is not None else "N/A"
 
-    predicted = analysis.predict()
     time_gencon = analysis.time_gencon
     time_solve = analysis.time_solve
+    constraint_cnt = analysis.constraints
     
     # if serial == sat:
     #     serial = "Serializable"
@@ -48,41 +94,68 @@ def run(filename, level, tactic, output):
         predicted = "unknown"
 
     out_file = "%s/%s_%s_%s.csv"%(output, db.in_file, str(level).split(".")[-1].lower(), str(tactic).split(".")[-1].lower())
-    headers = ["Benchmark", "Observed Execution", "Predicted Execution", "Constraint Generation", "Constraint Solving", "Total Events", "Total Transactions"]
-    values = [db.in_file, "N/A", predicted, time_gencon, time_solve, event_cnt, transaction_cnt]
+    values = [db.in_file, "N/A", predicted, time_gencon, time_solve, event_cnt, transaction_cnt, constraint_cnt, analysis.configuration, reduced_event_cnt, reduced_transaction_cnt, time_reduce]
 
     with open(out_file, "w") as out:
         writer = csv.writer(out)
-        writer.writerow(headers)
+        writer.writerow(HEADERS)
         writer.writerow(values)
 
     return values
 
-def run_benchmarks(tactic, level, dir="./microbenchmark", output="./out", mp=False):
-    bench_name = "%s_%s_%s"%(dir.rstrip("/").split("/")[-1], str(tactic).split(".")[-1].lower(), str(level).split(".")[-1].lower())
-    bench_dir = "./%s/%s"%(output, bench_name)
+def bench_name(dir, tactic, level, encoding, acyclicity, bound=None, deepen=False, decompose=0, reduce=False):
+    name = "%s_%s_%s"%(dir.rstrip("/").split("/")[-1], str(tactic).split(".")[-1].lower(), str(level).split(".")[-1].lower())
+    if encoding != Encoding.Dense:
+        name += "_%s"%(encoding.value)
+    if acyclicity != Acyclicity.Arithmetic:
+        name += "_%s"%(acyclicity.value)
+    if bound is not None:
+        name += "_b%d"%(bound)
+    if deepen:
+        name += "_deepen"
+    if decompose > 0:
+        name += "_decompose"
+    if reduce:
+        name += "_reduce"
+
+    return name
+
+def trace_files(dir):
+    # text traces (possibly compressed), or their binary conversions where available
+    traces = {}
+    patterns = ["*.txt", "*.txt.gz", "*.txt.xz", "*.txt.zst", "*%s"%tracefile.EXTENSION]
+    for file in [f for pattern in patterns for f in glob.glob("%s/%s"%(dir, pattern))]:
+        name = file.split("/")[-1].split(".")[0]
+        if name not in traces or file.endswith(tracefile.EXTENSION):
+            traces[name] = file
+
+    return list(traces.values())
+
+def process_count():
+    cpu_count = multiprocessing.cpu_count()
+    if cpu_count > 5:
+        cpu_count = 5
+    else:
+        cpu_count -= 1
+
+    return cpu_count
+
+def run_benchmarks(tactic, level, dir="./microbenchmark", output="./out", mp=False, use_cache=False, encoding=Encoding.Dense, acyclicity=Acyclicity.Arithmetic, portfolio=1, cubes=1, cube_choices=False, bound=None, deepen=False, decompose=0, reduce=False):
+    name = bench_name(dir, tactic, level, encoding, acyclicity, bound, deepen, decompose, reduce)
+    bench_dir = "./%s/%s"%(output, name)
     Path(bench_dir).mkdir(parents=True, exist_ok=True)
 
-    out_file = "%s/%s.tex"%(bench_dir, bench_name)
+    out_file = "%s/%s.tex"%(bench_dir, name)
     table = []
-    headers=["Benchmark", "Observed Execution", "Predicted Execution", "Constraint Generation", "Constraint Solving", "Total Events", "Total Transactions"]
 
-    files = []
-    for file in glob.glob("%s/%s"%(dir, "*.txt")):
-        files.append(file)
+    files = trace_files(dir)
 
     if mp:
-        cpu_count = multiprocessing.cpu_count()
-        if cpu_count > 5:
-            cpu_count = 5
-        else:
-            cpu_count -= 1
-
-        with multiprocessing.Pool(cpu_count, maxtasksperchild=1) as p:
-            table = p.map(functools.partial(run, level=level, tactic=tactic, output=bench_dir), files)
+        with multiprocessing.Pool(process_count(), maxtasksperchild=1) as p:
+            table = p.map(functools.partial(run, level=level, tactic=tactic, output=bench_dir, use_cache=use_cache, encoding=encoding, acyclicity=acyclicity, portfolio=portfolio, cubes=cubes, cube_choices=cube_choices, bound=bound, deepen=deepen, decompose=decompose, reduce=reduce), files)
     else:
         for f in files:
-            result = run(f, level=level, tactic=tactic, output=bench_dir)
+            result = run(f, level=level, tactic=tactic, output=bench_dir, use_cache=use_cache, encoding=encoding, acyclicity=acyclicity, portfolio=portfolio, cubes=cubes, cube_choices=cube_choices, bound=bound, deepen=deepen, decompose=decompose, reduce=reduce)
             if result is not None:
                 table.append(result)
 
@@ -90,4 +163,37 @@ def run_benchmarks(tactic, level, dir="./microbenchmark", output="./out", mp=Fal
     #     table.append(run(f, tactic))
 
     with open(out_file, "w") as out:
-        out.write(tabulate(sorted(table), headers, tablefmt="latex"))
+        out.write(tabulate(sorted(table), HEADERS, tablefmt="latex"))
+
+
+def run_matrix_benchmarks(tactics, levels, dir="./microbenchmark", output="./out", mp=False, use_cache=False, encoding=Encoding.Dense, acyclicity=Acyclicity.Arithmetic, portfolio=1, cubes=1, cube_choices=False, bound=None, reduce=False):
+    # same outputs as run_benchmarks for every level and tactic, but every trace is encoded once per solver
+    queries = []
+    tables = {}
+    for level in levels:
+        for tactic in tactics:
+            name = bench_name(dir, tactic, level, encoding, acyclicity, bound, reduce=reduce)
+            bench_dir = "./%s/%s"%(output, name)
+            Path(bench_dir).mkdir(parents=True, exist_ok=True)
+
+            queries.append((level, tactic, bench_dir))
+            tables[(level, tactic)] = ("%s/%s.tex"%(bench_dir, name), [])
+
+    files = trace_files(dir)
+
+    if mp:
+        with multiprocessing.Pool(process_count(), maxtasksperchild=1) as p:
+            results = p.map(functools.partial(run_matrix, queries=queries, use_cache=use_cache, encoding=encoding, acyclicity=acyclicity, portfolio=portfolio, cubes=cubes, cube_choices=cube_choices, bound=bound, reduce=reduce), files)
+    else:
+        results = [run_matrix(f, queries=queries, use_cache=use_cache, encoding=encoding, acyclicity=acyclicity, portfolio=portfolio, cubes=cubes, cube_choices=cube_choices, bound=bound, reduce=reduce) for f in files]
+
+    for result in results:
+        if result is None:
+            continue
+
+        for query, values in result.items():
+            tables[query][1].append(values)
+
+    for out_file, table in tables.values():
+        with open(out_file, "w") as out:
+            out.write(tabulate(sorted(table), HEADERS, tablefmt="latex"))
@@ -0,0 +1,95 @@
+import gc
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+# bump whenever tokenizing or the layout of DataStore changes, so stale entries are never loaded
+PARSER_VERSION = 3
+
+# parsed traces are kept in ISOPREDICT_CACHE, or ~/.cache/isopredict by default
+CACHE_DIR = os.environ.get("ISOPREDICT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "isopredict"))
+
+# total size of the cache, least recently used entries are evicted beyond this
+MAX_CACHE_SIZE = 1 << 30
+
+CACHE_EXTENSION = ".pickle"
+BLOCK_SIZE = 1 << 20
+
+def trace_hash(filename):
+    h = hashlib.blake2b(digest_size=20)
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+def cache_path(filename):
+    return os.path.join(CACHE_DIR, "%s-v%d%s"%(trace_hash(filename), PARSER_VERSION, CACHE_EXTENSION))
+
+def _without_gc(func, *args):
+    # the collector repeatedly rescans the millions of objects of a large trace while they are (un)pickled
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return func(*args)
+    finally:
+        if enabled:
+            gc.enable()
+
+def load(path):
+    # returns the DataStore cached at path, see cache_path, or None
+    try:
+        with open(path, "rb") as f:
+            db = _without_gc(pickle.load, f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print("[Error] ignoring unreadable cache entry %s: %s"%(path, e))
+        return None
+
+    # the modification time tracks the last use of an entry
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return db
+
+def store(path, db):
+    Path(CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+    # write to a private file first, concurrent benchmark runs may store the same trace
+    tmp_path = "%s.%d.tmp"%(path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as f:
+            _without_gc(pickle.dump, db, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print("[Error] cannot write cache entry %s: %s"%(path, e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+
+    evict()
+
+def evict(max_size=MAX_CACHE_SIZE):
+    # removes least recently used entries until the cache fits in max_size bytes
+    entries = []
+    for path in Path(CACHE_DIR).glob("*%s"%CACHE_EXTENSION):
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
@@ -1,7 +1,13 @@
+import functools
+import multiprocessing
+import os
 import re
 from z3 import *
 from pathlib import Path
 import isopredict.graph as graph
+import isopredict.cache as cache
+import isopredict.tracefile as tracefile
+from isopredict.strategy import Encoding
 
 INIT_SESSION = "0"
 INIT_TX = "0, 0"
@@ -9,6 +15,8 @@ FINAL_SESSION = "FIN"
 FINAL_TX = "FIN, FIN"
 
 class Event:
+    __slots__ = ("session", "transaction", "seq")
+
     def __init__(self, session_id, transaction_id, seq):
         self.session = session_id
         self.transaction = transaction_id
@@ -33,6 +41,8 @@ class Event:
         return "Session[%s]Tx[%s]Seq[%s]"%(self.session, self.transaction, self.seq)
     
 class Read(Event):
+    __slots__ = ("write_session", "write_tx", "write_seq", "key")
+
     def __init__(self, session_id, transaction_id, seq, write_session, write_tx, write_seq, key):
         super().__init__(session_id, transaction_id, seq)
         self.write_session = write_session
@@ -40,6 +50,10 @@ class Read(Event):
         self.write_seq = write_seq
         self.key = key
 
+    def __reduce__(self):
+        # compact pickles for the parsed-trace cache
+        return (Read, (self.session, self.transaction, self.seq, self.write_session, self.write_tx, self.write_seq, self.key))
+
     def __repr__(self):
         return "READ KEY[%s] Txn(%s) From(%s)\n"%(self.key, self.transaction, self.write_tx)
     
@@ -47,20 +61,92 @@ class Read(Event):
         return "READ KEY[%s] Txn(%s) From(%s)\n"%(self.key, self.transaction, self.write_tx)
     
 class Write(Event):
+    __slots__ = ("key",)
+
     def __init__(self, session_id, transaction_id, seq, key):
         super().__init__(session_id, transaction_id, seq)
         self.key = key
 
+    def __reduce__(self):
+        return (Write, (self.session, self.transaction, self.seq, self.key))
+
     def __repr__(self):
         return "WRITE KEY[%s] Txn(%s)\n"%(self.key, self.transaction)
     
     def __str__(self):
         return "WRITE KEY[%s] Txn(%s)\n"%(self.key, self.transaction)
     
+class SparseRelation:
+    # relation over transactions that can only hold on the given pairs of transaction ids
+    # applied like a z3 Function: a Bool for each of its pairs, False for every other pair
+    def __init__(self, name, tx_ids, pairs):
+        self.tx_ids = tx_ids    # key: ast id of a symbolic transaction  value: transaction_id
+        self.pairs = {pair: Bool("%s(T[%s], T[%s])"%(name, pair[0], pair[1])) for pair in pairs}
+        self.false = BoolVal(False)
+
+    def __call__(self, tx1, tx2):
+        return self.get(self.tx_ids[tx1.get_id()], self.tx_ids[tx2.get_id()])
+
+    def get(self, tx1_id, tx2_id):
+        return self.pairs.get((tx1_id, tx2_id), self.false)
+
+class ModelRelation:
+    # relation over transactions read out of a model once, a bitset of the related transactions for every transaction
+    def __init__(self, m, rel, tx):
+        self.index = {tx_id: i for i, tx_id in enumerate(tx)}
+        self.rows = [0] * len(self.index)
+
+        if isinstance(rel, SparseRelation):
+            for (tx1_id, tx2_id), b in rel.pairs.items():
+                if is_true(m.evaluate(b)):
+                    self.add(tx1_id, tx2_id)
+            return
+
+        # a function interpretation lists the pairs it differs from its default on,
+        # a function without one is not evaluated to true on any pair
+        interp = m[rel]
+        try:
+            default = interp.else_value() if interp is not None else None
+            entries = []
+            for i in range(interp.num_entries() if interp is not None else 0):
+                entry = interp.entry(i)
+                entries.append(((entry.arg_value(0), entry.arg_value(1)), entry.value()))
+        except Z3Exception:
+            return
+
+        if default is None:
+            default = BoolVal(False)
+
+        tx_ids = {t.get_id(): tx_id for tx_id, t in tx.items()}
+        entries = [((tx_ids.get(t1.get_id()), tx_ids.get(t2.get_id())), value) for (t1, t2), value in entries]
+
+        if all(is_true(v) or is_false(v) for v in [default] + [value for _, value in entries]) and all(None not in pair for pair, _ in entries):
+            if is_true(default):
+                self.rows = [(1 << len(self.index)) - 1] * len(self.index)
+            for (tx1_id, tx2_id), value in entries:
+                if is_true(value):
+                    self.add(tx1_id, tx2_id)
+                else:
+                    self.rows[self.index[tx1_id]] &= ~(1 << self.index[tx2_id])
+            return
+
+        # otherwise every pair is evaluated
+        for tx1_id, tx1 in tx.items():
+            for tx2_id, tx2 in tx.items():
+                if is_true(m.evaluate(rel(tx1, tx2))):
+                    self.add(tx1_id, tx2_id)
+
+    def add(self, tx1_id, tx2_id):
+        self.rows[self.index[tx1_id]] |= 1 << self.index[tx2_id]
+
+    def __call__(self, tx1_id, tx2_id):
+        return (self.rows[self.index[tx1_id]] >> self.index[tx2_id]) & 1 == 1
+
 class Symbolic:
-    def __init__(self, db, output="out"):
+    def __init__(self, db, output="out", encoding=Encoding.Dense):
         # execution trace
         self.db = db
+        self.encoding = encoding
 
         # output folder
         self.out = output
@@ -84,6 +170,53 @@ class Symbolic:
         self.reachable = Function("Reachable", self.smtTx, self.smtTx, BoolSort())
         self.rank = Function("Rank", self.smtTx, self.smtTx, IntSort())
 
+        # relations restricted to the pairs where they can hold
+        if encoding == Encoding.Sparse:
+            self._create_sparse_relations()
+
+        # relations read out of the last model, see model_relation
+        self.model = None
+        self.model_relations = {}
+
+    def _create_sparse_relations(self):
+        tx_ids = {tx.get_id(): tx_id for tx_id, tx in self.tx.items()}
+
+        # session order between consecutive transactions, and from the initial state
+        so_pairs = {}
+        for transactions in self.db.sessions.values():
+            so_pairs[(INIT_TX, transactions[0])] = True
+            for i in range(1, len(transactions)):
+                so_pairs[(transactions[i - 1], transactions[i])] = True
+        so_pairs.pop((INIT_TX, INIT_TX), None)
+
+        # per-key pairs: writer to reader, between writers, and reader to writer
+        wr_pairs = {}
+        ww_pairs = {}
+        rw_pairs = {}
+        for key, write_history in self.db.write_history.items():
+            read_history = self.db.read_history.get(key, [])
+            wr_pairs[key] = {(w.transaction, r.transaction): True for w in write_history for r in read_history if w.transaction != r.transaction}
+
+            # arbitration is only constrained over keys that are read
+            ww_pairs[key] = {}
+            rw_pairs[key] = {}
+            if read_history:
+                ww_pairs[key] = {(c.transaction, w.transaction): True for w in write_history for c in write_history if c.transaction != w.transaction}
+                rw_pairs[key] = {(r.transaction, c.transaction): True for r in read_history for c in write_history if r.transaction != c.transaction}
+
+        def union(pairs):
+            return {pair: True for key_pairs in pairs.values() for pair in key_pairs}
+
+        self.so = SparseRelation("Session-Order", tx_ids, so_pairs)
+        self.wrk = {key: SparseRelation("Write-Read-%s"%key, tx_ids, pairs) for key, pairs in wr_pairs.items()}
+        self.wr = SparseRelation("Write-Read", tx_ids, union(wr_pairs))
+        self.ark = {key: SparseRelation("Causal-Arbitration-%s"%key, tx_ids, pairs) for key, pairs in ww_pairs.items()}
+        self.ar = SparseRelation("Causal-Aribtration", tx_ids, union(ww_pairs))
+        self.wwk = {key: SparseRelation("Serial-Arbitration-%s"%key, tx_ids, pairs) for key, pairs in ww_pairs.items()}
+        self.ww = SparseRelation("Serial-Arbitration", tx_ids, union(ww_pairs))
+        self.rwk = {key: SparseRelation("Serial-Antidependency-%s"%key, tx_ids, pairs) for key, pairs in rw_pairs.items()}
+        self.rw = SparseRelation("Serial-AntiDependency", tx_ids, union(rw_pairs))
+
     def _create_tx_type(self):
         Transaction = Datatype("Transaction")
 
@@ -132,6 +265,91 @@ class Symbolic:
 
         return co
     
+    def sparse_constraints(self, rel, candidates, value=Or):
+        # a sparse relation holds on its pairs exactly when one of their candidates does
+        return [v == value(candidates[pair]) if pair in candidates else Not(v) for pair, v in rel.pairs.items()]
+
+    def sparse_union_constraints(self, rel, relk):
+        # a sparse relation is the union of its per-key relations
+        union = {}
+        for rel_k in relk.values():
+            for pair, v in rel_k.pairs.items():
+                if pair not in union:
+                    union[pair] = []
+                union[pair].append(v)
+
+        return [v == Or(union[pair]) for pair, v in rel.pairs.items()]
+
+    def bounded_hb_constraints(self, must_edges, may_edges):
+        # happens-before holds between transactions connected by edges that always exist, never between transactions
+        # that no possible so or wr edges connect, and is a symbolic transitive closure only in between
+        must = graph.Reachability(self.tx.keys(), must_edges)
+        may = must if may_edges is must_edges else graph.Reachability(self.tx.keys(), may_edges)
+
+        predecessors = {}
+        for tx1_id, tx2_id in may_edges:
+            if tx2_id not in predecessors:
+                predecessors[tx2_id] = {}
+            predecessors[tx2_id][tx1_id] = True
+
+        constraints = []
+        for tx1_id, tx1 in self.tx.items():
+            for tx2_id, tx2 in self.tx.items():
+                if tx1_id == tx2_id or not may(tx1_id, tx2_id):
+                    constraints.append(Not(self.hb(tx1, tx2)))
+                    continue
+
+                if must(tx1_id, tx2_id):
+                    constraints.append(self.hb(tx1, tx2))
+                    continue
+
+                hb_constraints = [self.wr(tx1, tx2), self.so(tx1, tx2)]
+                for tx3_id in predecessors.get(tx2_id, {}):
+                    if tx3_id != tx1_id and may(tx1_id, tx3_id):
+                        tx3 = self.tx[tx3_id]
+                        hb_constraints.append(And(self.hb(tx1, tx3), Or(self.wr(tx3, tx2), self.so(tx3, tx2))))
+
+                constraints.append(self.hb(tx1, tx2) == Or(hb_constraints))
+
+        return constraints
+
+    def related_pairs(self, *rels):
+        # pairs of symbolic transactions on which any of the sparse relations can hold
+        pairs = {}
+        for rel in rels:
+            for pair in rel.pairs:
+                pairs[pair] = True
+
+        return [(tx1_id, tx2_id, self.tx[tx1_id], self.tx[tx2_id]) for tx1_id, tx2_id in pairs]
+
+    def all_pairs(self):
+        # every ordered pair of distinct symbolic transactions
+        return [(tx1_id, tx2_id, tx1, tx2) for tx1_id, tx1 in self.tx.items() for tx2_id, tx2 in self.tx.items() if tx1_id != tx2_id]
+
+    def constraint_count(self, s):
+        # number of top-level conjuncts asserted in s
+        cnt = 0
+        todo = list(s.assertions())
+        while todo:
+            a = todo.pop()
+            if is_and(a):
+                todo.extend(a.children())
+            else:
+                cnt += 1
+
+        return cnt
+
+    def model_relation(self, m, rel):
+        # rel in model m, read out of the model on the first query and served from the matrix afterwards
+        if self.model is not m:
+            self.model = m
+            self.model_relations = {}
+
+        if id(rel) not in self.model_relations:
+            self.model_relations[id(rel)] = ModelRelation(m, rel, self.tx)
+
+        return self.model_relations[id(rel)]
+
     def print_assertions(self, s):
         out_file = "%s/assert_%s.txt"%(self.out, self.db.in_file)
         with open(out_file, "w") as out:
@@ -151,90 +369,160 @@ class Symbolic:
         # graph representation of the model
         g = graph.Graph("visualization_%s"%(self.db.in_file))
 
+        # every relation is read out of the model once
+        session_order = self.model_relation(m, self.so)
+        write_read = self.model_relation(m, self.wr)
+        causal_arb = self.model_relation(m, self.ar)
+        write_write = self.model_relation(m, self.ww)
+        read_write = self.model_relation(m, self.rw)
+
         # populate the graph with edges & nodes from the model
-        for t_id, t in self.tx.items():
-            for u_id, u in self.tx.items():
+        for t_id in self.tx:
+            for u_id in self.tx:
                 if t_id == u_id:
                     continue
 
                 src = "T[%s]"%(t_id)
                 dst = "T[%s]"%(u_id)
 
-                session_order = m.evaluate(self.so(t, u))
-                write_read = m.evaluate(self.wr(t, u))
-                causal_arb = m.evaluate(self.ar(t, u))
-                write_write = m.evaluate(self.ww(t, u))
-                read_write = m.evaluate(self.rw(t, u))
-
-                if is_true(session_order):
+                if session_order(t_id, u_id):
                     g.add_edge(src, dst, "so")
 
-                if is_true(write_read):
-                    keys = []
-                    for k, wrx in self.wrk.items():
-                        if is_true(m.evaluate(wrx(t, u))):
-                            keys.append(k)
-
+                if write_read(t_id, u_id):
+                    keys = [k for k, wrx in self.wrk.items() if self.model_relation(m, wrx)(t_id, u_id)]
                     g.add_edge(src, dst, "wr[%s]"%("\n".join(keys)))
 
-                if is_true(causal_arb):
-                    keys = []
-                    for k, arx in self.ark.items():
-                        if is_true(m.evaluate(arx(t, u))):
-                            keys.append(k)
-
+                if causal_arb(t_id, u_id):
+                    keys = [k for k, arx in self.ark.items() if self.model_relation(m, arx)(t_id, u_id)]
                     g.add_edge(src, dst, "ar[%s]"%("\n".join(keys)))
 
-                if is_true(write_write):
-                    keys = []
-                    for k, wwx in self.wwk.items():
-                        if is_true(m.evaluate(wwx(t, u))):
-                            keys.append(k)
-
+                if write_write(t_id, u_id):
+                    keys = [k for k, wwx in self.wwk.items() if self.model_relation(m, wwx)(t_id, u_id)]
                     g.add_edge(src, dst, "ww[%s]"%("\n".join(keys)))
 
-                if is_true(read_write):
-                    keys = []
-                    for k, rwx in self.rwk.items():
-                        if is_true(m.evaluate(rwx(t, u))):
-                            keys.append(k)
-
+                if read_write(t_id, u_id):
+                    keys = [k for k, rwx in self.rwk.items() if self.model_relation(m, rwx)(t_id, u_id)]
                     g.add_edge(src, dst, "rw[%s]"%("\n".join(keys)))
 
         g.visualize()
 
 
+class Interner:
+    # assigns dense integer ids to names in order of first appearance
+    __slots__ = ("ids", "names")
+
+    def __init__(self):
+        self.ids = {}    # key: name  value: integer id
+        self.names = []    # key: integer id  value: name
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        # returns the canonical copy of name, so that equal names are the same object
+        i = self.ids.get(name)
+        if i is None:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            return name
+
+        return self.names[i]
+
+    def id(self, name):
+        return self.ids[name]
+
+    def name(self, i):
+        return self.names[i]
+
+class Session(list):
+    # transaction ids of a session in session order, with constant time membership tests
+    def __init__(self, transactions=()):
+        super().__init__(transactions)
+        self.members = set(self)
+
+    def __contains__(self, tx_id):
+        return tx_id in self.members
+
+    def append(self, tx_id):
+        super().append(tx_id)
+        self.members.add(tx_id)
+
+class TraceStats:
+    # snapshot of the statistics of a trace, see DataStore.stats
+    def __init__(self, db):
+        self.events = db.event_count()
+        self.reads = db.read_count()
+        self.writes = db.write_count()
+        self.transactions = db.transaction_count()
+        self.sessions = db.session_count()
+        self.read_only_transactions = db.read_only_tx_count()
+        self.write_only_transactions = db.write_only_tx_count()
+        self.conflicts = db.conflicts_count()
+        self.max_conflicting_writes = db.max_conflicting_write_count()
+        self.conflicting_write_transactions = db.conflicting_write_tx_count()
+
+    def __repr__(self):
+        return "TraceStats(%s)"%(", ".join("%s=%d"%item for item in vars(self).items()))
+
+# keys with more writes than this are conflicts
+CONFLICT_THRESHOLD = 2
+
 class DataStore:
     def __init__(self, in_file=""):
-        self.sessions = {}   # key: session_id  value: list of transaction_id
+        self.sessions = {}   # key: session_id  value: Session, the list of transaction_id
         self.write_history = {}   # key: data_key  value: list of write Events that wrote to the same data_key
         self.read_history = {}    # key: data_key  value: list of read Events that read the key
+        self.write_index = {}    # key: (session_id, transaction_id, data_key)  value: that transaction's write Event in write_history[data_key]
         self.session_event_count = {}    # key: session_id  value: total number of events in the session
         self.first_event_in_tx = {}    # key: transaction_id  value: sequence number of first event in the transaction
         self.transaction_event_count = {}    # key: transaction_id  value: total number of events in the transaction
         self.session_read_events = {}    # key: session_id  value: list of that session's read events' sequence numbers
         self.observed_co = {}    # key: transaction_id  value: the order in which the transaction appeared in the observed exec
         self.in_file = in_file    # filename of the database log
+        self.origin = None    # trace this trace was reduced from, see reduce
+        self.collapsed = {}    # key: transaction_id of origin left out by reduce  value: closest remaining transaction before it in session order
+
+        # interned identifiers
+        self.session_ids = Interner()
+        self.tx_ids = Interner()
+        self.key_ids = Interner()
+
+        # statistics, maintained as events are added and removed
+        self.total_tx = 0    # number of transactions in all sessions
+        self.total_reads = 0    # number of read events
+        self.total_writes = 0    # number of write events in write_history, except those of the initial session
+        self.tx_reads = {}    # key: transaction_id  value: number of its read events
+        self.tx_writes = {}    # key: transaction_id  value: number of its write events in write_history
+        self.reading_tx = 0    # number of transactions with read events, except INIT_TX
+        self.writing_tx = 0    # number of transactions with write events in write_history
+        self.history_sizes = {}    # key: length of a write history  value: number of keys with a history of that length
+        self.max_history_size = 0
+        self.conflicts = 0    # number of keys with more than CONFLICT_THRESHOLD writes
+        self.tx_conflicting_writes = {}    # key: transaction_id  value: number of its writes to conflicting keys
+        self.conflicting_write_tx = 0    # number of transactions writing to conflicting keys, except INIT_TX
+
+    def find_write(self, session_id, transaction_id, data_key):
+        # a transaction keeps at most one (its most recent) write per key in the write history
+        return self.write_index.get((session_id, transaction_id, data_key))
 
     def find_write_seq(self, session_id, transaction_id, data_key):
-        write_seq = -1
+        write = self.find_write(session_id, transaction_id, data_key)
+        if write is None:
+            return -1
 
-        # find write history
-        if data_key not in self.write_history:
-            return write_seq
-        
-        # find the most recent write on data_key from that particular session/transaction
-        write_history = self.write_history[data_key]
-        for event in write_history:
-            if event.session == session_id and event.transaction == transaction_id and event.seq > write_seq:
-                write_seq = event.seq
-        
-        return write_seq
+        return write.seq
 
     def add_read(self, session_id, tx_id, key, read_from_tx, read_from_session, ignore_po=False):
+        # use the canonical copies of identifiers
+        session_id = self.session_ids.intern(session_id)
+        tx_id = self.tx_ids.intern(tx_id)
+        key = self.key_ids.intern(key)
+        read_from_session = self.session_ids.intern(read_from_session)
+        read_from_tx = self.tx_ids.intern(read_from_tx)
+
         # find the correct session
         if session_id not in self.sessions:
-            self.sessions[session_id] = []
+            self.sessions[session_id] = Session()
         session = self.sessions[session_id]
 
         # skip local reads
@@ -264,6 +552,7 @@ class DataStore:
         if tx_id not in session:
             session.append(tx_id)
             self.first_event_in_tx[tx_id] = seq
+            self.total_tx += 1
 
         # find current number of events in transaction
         if tx_id not in self.transaction_event_count:
@@ -280,6 +569,9 @@ class DataStore:
         read_ev = Read(session_id, tx_id, seq, read_from_session, read_from_tx, write_seq, key)
         read_history.append(read_ev)
 
+        # update statistics
+        self._count_added_read(read_ev)
+
         # append sequence number to session_read_event list
         if session_id not in self.session_read_events:
             self.session_read_events[session_id] = []
@@ -290,20 +582,29 @@ class DataStore:
         self.transaction_event_count[tx_id] += 1
 
     def remove_write(self, session_id, tx_id, key):
-        if key not in self.write_history:
+        write = self.write_index.pop((session_id, tx_id, key), None)
+        if write is None:
             return
         
+        # a transaction writing the same key again is usually the latest writer of the key
         write_history = self.write_history[key]
-        for event in write_history:
-            if event.session == session_id and event.transaction == tx_id:
-                write_history.remove(event)
+        if write_history[-1] is write:
+            write_history.pop()
+        else:
+            write_history.remove(write)
+        self._count_removed_write(write_history, write)
         
         return
 
     def add_write(self, session_id, tx_id, key, init_tx=False):
+        # use the canonical copies of identifiers
+        session_id = self.session_ids.intern(session_id)
+        tx_id = self.tx_ids.intern(tx_id)
+        key = self.key_ids.intern(key)
+
         # find the correct session
         if session_id not in self.sessions:
-            self.sessions[session_id] = []
+            self.sessions[session_id] = Session()
         session = self.sessions[session_id]
 
         # calculate observed commit order
@@ -324,6 +625,7 @@ class DataStore:
         if tx_id not in session:
             session.append(tx_id)
             self.first_event_in_tx[tx_id] = seq
+            self.total_tx += 1
 
         # find current number of events in transaction
         if tx_id not in self.transaction_event_count:
@@ -332,18 +634,99 @@ class DataStore:
         # remove existing write event
         self.remove_write(session_id, tx_id, key)
 
-        # add tx to the write_history if it's not in there
+        # add tx to the write_history, the initial state goes first
         write_ev = Write(session_id, tx_id, seq, key)
-        if write_ev not in write_history:
-            if not init_tx:
-                write_history.append(write_ev)
-            else:
-                write_history.insert(0, write_ev)
+        if not init_tx:
+            write_history.append(write_ev)
+        else:
+            write_history.insert(0, write_ev)
+        self.write_index[(session_id, tx_id, key)] = write_ev
+        self._count_added_write(write_history, write_ev)
 
         # increment sequence count
         self.session_event_count[session_id] = seq + 1
         self.transaction_event_count[tx_id] += 1
 
+    def _count_added_read(self, read):
+        tx_id = read.transaction
+        reads = self.tx_reads.get(tx_id, 0)
+        if reads == 0 and tx_id != INIT_TX:
+            self.reading_tx += 1
+        self.tx_reads[tx_id] = reads + 1
+        self.total_reads += 1
+
+    def _count_added_write(self, write_history, write):
+        # write_history already contains write
+        size = len(write_history)
+        sizes = self.history_sizes
+        if size > 1:
+            sizes[size - 1] -= 1
+        sizes[size] = sizes.get(size, 0) + 1
+        if size > self.max_history_size:
+            self.max_history_size = size
+
+        if write.session != INIT_SESSION:
+            self.total_writes += 1
+
+        tx_id = write.transaction
+        writes = self.tx_writes.get(tx_id, 0)
+        if writes == 0:
+            self.writing_tx += 1
+        self.tx_writes[tx_id] = writes + 1
+
+        # the key becomes a conflict, or was one already
+        if size == CONFLICT_THRESHOLD + 1:
+            self.conflicts += 1
+            for w in write_history:
+                self._count_conflicting_write(w.transaction, 1)
+        elif size > CONFLICT_THRESHOLD + 1:
+            self._count_conflicting_write(tx_id, 1)
+
+    def _count_removed_write(self, write_history, write):
+        # write_history no longer contains write
+        size = len(write_history)
+        sizes = self.history_sizes
+        sizes[size + 1] -= 1
+        if size > 0:
+            sizes[size] = sizes.get(size, 0) + 1
+        if size + 1 == self.max_history_size and sizes[size + 1] == 0:
+            self.max_history_size = size
+
+        if write.session != INIT_SESSION:
+            self.total_writes -= 1
+
+        tx_id = write.transaction
+        writes = self.tx_writes[tx_id] - 1
+        if writes == 0:
+            self.writing_tx -= 1
+        self.tx_writes[tx_id] = writes
+
+        # the key stops being a conflict, or still is one
+        if size == CONFLICT_THRESHOLD:
+            self.conflicts -= 1
+            self._count_conflicting_write(tx_id, -1)
+            for w in write_history:
+                self._count_conflicting_write(w.transaction, -1)
+        elif size > CONFLICT_THRESHOLD:
+            self._count_conflicting_write(tx_id, -1)
+
+    def _count_conflicting_write(self, tx_id, delta):
+        writes = self.tx_conflicting_writes.get(tx_id, 0)
+        if tx_id != INIT_TX:
+            if writes == 0:
+                self.conflicting_write_tx += 1
+            elif writes + delta == 0:
+                self.conflicting_write_tx -= 1
+        self.tx_conflicting_writes[tx_id] = writes + delta
+
+    def add_operations(self, operations):
+        # operations are (op, session, transaction, key, read_from_session, read_from_tx) tuples, see tokenize_log
+        for op, session, tx, key, read_from_session, read_from in operations:
+            if op == OP_READ:
+                self.add_read(session, tx, key, read_from, read_from_session)
+            else:
+                self.add_write(session, tx, key)
+
     def add_initial_state(self):
         init_session = INIT_SESSION
         init_tx = INIT_TX
@@ -358,21 +741,133 @@ class DataStore:
             last_write = history[-1]
             self.add_read(FINAL_SESSION, FINAL_TX, k, last_write.transaction, last_write.session, True)
 
+    def components(self):
+        # sessions grouped so that no wr, ww or rw relation connects transactions of different groups: those only
+        # relate transactions over a key that is read and written by a transaction other than the initial state
+        edges = []
+        for key, read_history in self.read_history.items():
+            sessions = {w.session for w in self.write_history[key] if w.session != INIT_SESSION}
+            if not sessions:
+                continue
+
+            sessions.update(r.session for r in read_history)
+            sessions = list(sessions)
+            edges += [(sessions[0], session_id) for session_id in sessions[1:]]
+
+        return graph.components([session_id for session_id in self.sessions if session_id != INIT_SESSION], edges)
+
+    def restrict(self, session_ids, in_file=None):
+        # trace of the given sessions and the initial state, keeping their events and sequence numbers;
+        # keys of other sessions only keep their initial state and are left out
+        sessions = set(session_ids)
+        sessions.add(INIT_SESSION)
+        in_file = self.in_file if in_file is None else in_file
+
+        sub = self._subtrace(in_file, {s_id: transactions for s_id, transactions in self.sessions.items() if s_id in sessions},
+                             lambda writes, reads: reads or any(w.session != INIT_SESSION for w in writes))
+
+        # a reduced trace restricts the trace it was reduced from along with it
+        if self.origin is not None:
+            sub.origin = self.origin.restrict(session_ids, in_file)
+            sub.collapsed = {tx_id: prev_id for tx_id, prev_id in self.collapsed.items() if tx_id in sub.origin.first_event_in_tx}
+
+        return sub
+
+    def reduce(self):
+        # trace without the keys that no prediction can change: a key that is never read relates no transactions,
+        # and reads of a key that only the initial state writes can only read from it, which session order implies;
+        # transactions left with neither reads nor writes only pass session order on and are collapsed,
+        # collapsed maps them to the closest remaining transaction before them in their session
+        keys = {key for key, read_history in self.read_history.items() if any(w.session != INIT_SESSION for w in self.write_history[key])}
+        writing = {w.transaction for key in keys for w in self.write_history[key]}
+
+        sessions = {}
+        collapsed = {}
+        for session_id, transactions in self.sessions.items():
+            remaining = Session()
+            for tx_id in transactions:
+                # a boundary can fall inside any transaction with reads, see event_boundary_constraints
+                relevant = session_id == INIT_SESSION or self.tx_reads.get(tx_id, 0) > 0 or tx_id in writing
+                if relevant:
+                    remaining.append(tx_id)
+                else:
+                    collapsed[tx_id] = remaining[-1] if remaining else INIT_TX
+
+            if remaining:
+                sessions[session_id] = remaining
+
+        sub = self._subtrace(self.in_file, sessions, lambda writes, reads: writes and writes[0].key in keys)
+        sub.origin = self
+        sub.collapsed = collapsed
+
+        return sub
+
+    def _subtrace(self, in_file, sessions, relevant):
+        # trace of the given sessions (key: session_id  value: transaction ids) and the events of their transactions
+        # over the keys for which relevant(writes, reads) holds; sequence numbers, boundary candidates and the observed
+        # commit order, and so the distance between transactions, stay those of this trace
+        sub = DataStore(in_file)
+        sub.session_ids = self.session_ids
+        sub.tx_ids = self.tx_ids
+        sub.key_ids = self.key_ids
+
+        for session_id, transactions in sessions.items():
+            sub.sessions[session_id] = Session(transactions)
+            sub.session_event_count[session_id] = self.session_event_count[session_id]
+            if session_id in self.session_read_events:
+                sub.session_read_events[session_id] = list(self.session_read_events[session_id])
+
+            for tx_id in transactions:
+                sub.first_event_in_tx[tx_id] = self.first_event_in_tx[tx_id]
+                sub.transaction_event_count[tx_id] = self.transaction_event_count[tx_id]
+                sub.observed_co[tx_id] = self.observed_co[tx_id]
+                sub.total_tx += 1
+
+        for key, write_history in self.write_history.items():
+            writes = [w for w in write_history if w.transaction in sub.first_event_in_tx]
+            reads = [r for r in self.read_history.get(key, []) if r.transaction in sub.first_event_in_tx]
+            if not relevant(writes, reads):
+                continue
+
+            sub.write_history[key] = []
+            for w in writes:
+                sub.write_history[key].append(w)
+                sub.write_index[(w.session, w.transaction, key)] = w
+                sub._count_added_write(sub.write_history[key], w)
+
+            if reads:
+                sub.read_history[key] = reads
+                for r in reads:
+                    sub._count_added_read(r)
+
+        return sub
+
     def transaction_distance(self, tx1, tx2):
         if tx1 not in self.observed_co or tx2 not in self.observed_co:
             return -1
         
-        distance = abs(self.observed_co[tx1] - self.observed_co[tx2])
+        distance = abs(self.observed_position(tx1) - self.observed_position(tx2))
 
         return distance
 
+    def max_distance(self):
+        # largest distance between two transactions, the bound that prunes nothing
+        return max([self.observed_position(tx) for tx in self.observed_co] + [-1]) + 1
+
+    def observed_position(self, tx):
+        # position of tx in the observed commit order of the other transactions,
+        # the initial state commits before all of them, wherever the trace or add_initial_state added it
+        if tx == INIT_TX:
+            return -1
+
+        position = self.observed_co[tx]
+        if self.observed_co.get(INIT_TX, position) < position:
+            position -= 1
+
+        return position
+
     def transaction_count(self):
-        cnt = 0
-        for session_id, transactions in self.sessions.items():
-            if session_id == INIT_SESSION:
-                continue
-            cnt += len(transactions)
-        return cnt
+        return self.total_tx - len(self.sessions.get(INIT_SESSION, ()))
     
     def session_count(self):
         return len(self.sessions) - 1
@@ -381,79 +876,29 @@ class DataStore:
         return self.read_count() + self.write_count()
     
     def read_count(self):
-        cnt = 0
-        for history in self.read_history.values():
-            cnt += len(history)
-
-        return cnt
+        return self.total_reads
     
     def write_count(self):
-        cnt = 0
-        for history in self.write_history.values():
-            for write in history:
-                if write.session == INIT_SESSION:
-                    continue
-                cnt += 1
-        
-        return cnt
+        return self.total_writes
     
     def max_conflicting_write_count(self):
-        cnt = 0
-        for history in self.write_history.values():
-            conflicts = len(history) - 2
-            if conflicts > cnt:
-                cnt = conflicts
-        return cnt
+        return max(self.max_history_size - CONFLICT_THRESHOLD, 0)
     
     def conflicts_count(self):
-        cnt = 0
-        for history in self.write_history.values():
-            if len(history) > 2:
-                cnt += 1
-        return cnt
+        return self.conflicts
 
     def read_only_tx_count(self):
-        cnt = 0
-        write_tx = set()
-        for history in self.write_history.values():
-            for write in history:
-                write_tx.add(write.transaction)
-        
-        for transactions in self.sessions.values():
-            for tx in transactions:
-                if tx not in write_tx:
-                    cnt += 1
-        
-        return cnt
+        return self.total_tx - self.writing_tx
     
     def write_only_tx_count(self):
-        cnt = 0
-        read_tx = set()
-        for history in self.read_history.values():
-            for read in history:
-                read_tx.add(read.transaction)
-
-        for transactions in self.sessions.values():
-            for tx in transactions:
-                if tx == INIT_TX:
-                    continue
-                if tx not in read_tx:
-                    cnt += 1
-        
-        return cnt
+        init_tx = 1 if INIT_TX in self.first_event_in_tx else 0
+        return self.total_tx - init_tx - self.reading_tx
     
     def conflicting_write_tx_count(self):
-        conflicting_writes = set()
-        for history in self.write_history.values():
-            if len(history) <= 2:
-                continue
+        return self.conflicting_write_tx
 
-            for write in history:
-                if write.transaction == INIT_TX:
-                    continue
-                conflicting_writes.add(write.transaction)
-        
-        return len(conflicting_writes)
+    def stats(self):
+        return TraceStats(self)
     
     def show_write_history(self):
         print("Conflicting Writes\n")
@@ -465,21 +910,9 @@ class DataStore:
     def show_tx_summary(self):
         print("Transaction Summary")
 
-        read_cnt = {}
-        write_cnt = {}
+        read_cnt = self.tx_reads
+        write_cnt = self.tx_writes
 
-        for history in self.read_history.values():
-            for read in history:
-                if read.transaction not in read_cnt:
-                    read_cnt[read.transaction] = 0
-                read_cnt[read.transaction] += 1
-            
-        for history in self.write_history.values():
-            for write in history:
-                if write.transaction not in write_cnt:
-                    write_cnt[write.transaction] = 0
-                write_cnt[write.transaction] += 1
-        
         # for session, transactions in self.sessions.items():
         #     if session == INIT_SESSION:
         #         continue
@@ -515,12 +948,13 @@ class DataStore:
     
     def show_stats(self):
         border = "-" * 24
-        total_events = self.event_count()
-        total_reads = self.read_count()
-        total_writes = self.write_count()
-        read_only_tx = self.read_only_tx_count()
-        total_tx = self.transaction_count()
-        total_sessions = self.session_count()
+        stats = self.stats()
+        total_events = stats.events
+        total_reads = stats.reads
+        total_writes = stats.writes
+        read_only_tx = stats.read_only_transactions
+        total_tx = stats.transactions
+        total_sessions = stats.sessions
 
         print(border)
         print("Total Events: %d"%(total_events))
@@ -533,114 +967,156 @@ class DataStore:
 
         self.show_tx_summary()
 
+    def show_reduction(self):
+        # size of a reduced trace next to the trace it was reduced from
+        origin = self.origin
+        print("Reduced trace: %d/%d events, %d/%d transactions, %d/%d keys"%(
+            self.event_count(), origin.event_count(),
+            self.transaction_count(), origin.transaction_count(),
+            len(self.write_history), len(origin.write_history)))
+
         # self.show_write_history()
         # print(border)
 
-def parse_log(filename):
-    in_file = filename.split("/")[-1]
-    in_file = in_file.split(".")[0]
-    db = DataStore(in_file)
-    line_num = 0
-
-    with open(filename) as f:
-        print("Parsing log file: %s"%filename)
-        for line in f:
-            line_num += 1
-
-            read = re.search("KEY\[(.+?)\].*Txn\((.+?)\) From\((.+?)\)", line)
-            if read:
-                key = read.group(1)
-                tx = read.group(2)
-                read_from = read.group(3)
-
-                # parse tx for session info
-                tx_info = re.search("(.+?), (.+?)", tx)
-                session = tx_info.group(1)
-                seq = tx_info.group(2)
-
-                # parse the read_from tx for session info
-                tx_info_read_from = re.search("(.+?), (.+?)", read_from)
-                read_from_session = tx_info_read_from.group(1)
-                seq_read_from = tx_info_read_from.group(2)
-
-                db.add_read(session, tx, key, read_from, read_from_session)
-
-                # skip the remaining regex matching
-                continue
-
-            write = re.search("KEY\[(.+?)\] Txn\((.+?)\)", line)
-            if write:
-                key = write.group(1)
-                tx = write.group(2)
-
-                # parse tx for session info
-                tx_info = re.search("(.+?), (.+?)", tx)
-                session = tx_info.group(1)
-                seq = tx_info.group(2)
-
-                db.add_write(session, tx, key)
-
-                # skip the remaining regex matching
+# operations produced by tokenize_log
+OP_READ = 0
+OP_WRITE = 1
+
+# formats of trace lines, in the order they are tried on unrecognized lines
+READ_FORMAT = re.compile(r"KEY\[(.+?)\].*Txn\((.+?)\) From\((.+?)\)")
+WRITE_FORMAT = re.compile(r"KEY\[(.+?)\] Txn\((.+?)\)")
+INSERT_FORMAT = re.compile(r"INSERT\[(.+?)\] to Set\[(.+?)\] Txn\((.+?)\)")
+CONTAINS_FORMAT = re.compile(r"CONTAINS\[(.+?)\] in Set\[(.+?)\] From\((.+?)\) Txn\((.+?)\)")
+DELETE_FORMAT = re.compile(r"DELETE\[(.+?)\] from Set\[(.+?)\] Txn\((.+?)\)")
+LINE_FORMATS = [READ_FORMAT, WRITE_FORMAT, INSERT_FORMAT, CONTAINS_FORMAT, DELETE_FORMAT]
+
+# key: first 4 characters of a line  value: (format of the line, position where the format starts)
+KEYWORD_FORMATS = {
+    "READ": (READ_FORMAT, len("READ ")),
+    "WRIT": (WRITE_FORMAT, len("WRITE ")),
+    "INSE": (INSERT_FORMAT, 0),
+    "CONT": (CONTAINS_FORMAT, 0),
+    "DELE": (DELETE_FORMAT, 0),
+}
+
+def session_of(tx_id):
+    # transaction ids look like "session, sequence"
+    return tx_id.partition(", ")[0]
+
+def _token(fmt, m):
+    if fmt is READ_FORMAT:
+        key, tx, read_from = m.groups()
+        return (OP_READ, session_of(tx), tx, key, session_of(read_from), read_from)
+
+    if fmt is WRITE_FORMAT:
+        key, tx = m.groups()
+        return (OP_WRITE, session_of(tx), tx, key, None, None)
+
+    if fmt is CONTAINS_FORMAT:
+        data_key, set_key, read_from, tx = m.groups()
+        return (OP_READ, session_of(tx), tx, "Set(%s:%s)"%(set_key, data_key), session_of(read_from), read_from)
+
+    # inserts and deletes write to an element of the set
+    data_key, set_key, tx = m.groups()
+    return (OP_WRITE, session_of(tx), tx, "Set(%s:%s)"%(set_key, data_key), None, None)
+
+def tokenize_log(lines):
+    # yields (op, session, transaction, key, read_from_session, read_from_tx) for every operation in the trace
+    for line in lines:
+        keyword = KEYWORD_FORMATS.get(line[:4])
+        if keyword is not None:
+            fmt, pos = keyword
+            m = fmt.match(line, pos)
+            if m:
+                yield _token(fmt, m)
                 continue
 
-            insert = re.search("INSERT\[(.+?)\] to Set\[(.+?)\] Txn\((.+?)\)", line)
-            if insert:
-                data_key = insert.group(1)
-                set_key = insert.group(2)
-                tx = insert.group(3)
-                
-                # parse tx for session info
-                tx_info = re.search("(.+?), (.+?)", tx)
-                session = tx_info.group(1)
-                seq = tx_info.group(2)
-
-                set_op = "Set(%s:%s)"%(set_key, data_key)
-
-                db.add_write(session, tx, set_op)
-                
-                # skip the remaining regex matching
-                continue
-
-            contains = re.search("CONTAINS\[(.+?)\] in Set\[(.+?)\] From\((.+?)\) Txn\((.+?)\)", line)
-            if contains:
-                data_key = contains.group(1)
-                set_key = contains.group(2)
-                from_tx = contains.group(3)
-                tx = contains.group(4)
-
-                # parse tx for session info
-                tx_info = re.search("(.+?), (.+?)", tx)
-                session = tx_info.group(1)
-                seq = tx_info.group(2)
+        # slow path for lines without a leading keyword, e.g. interleaved output
+        if "[" not in line:
+            continue
+
+        for fmt in LINE_FORMATS:
+            m = fmt.search(line)
+            if m:
+                yield _token(fmt, m)
+                break
+
+# smallest chunk handed to a parsing process
+MIN_CHUNK_SIZE = 1 << 22
+
+def _chunk_offsets(filename, jobs):
+    # byte ranges of about equal size, each ending right after a newline
+    size = os.path.getsize(filename)
+    chunks = max(1, min(jobs, size // MIN_CHUNK_SIZE))
+    offsets = [0]
+
+    with open(filename, "rb") as f:
+        for i in range(1, chunks):
+            f.seek(max(size * i // chunks, offsets[-1]))
+            f.readline()
+            offsets.append(f.tell())
+    offsets.append(size)
+
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if start < end]
+
+def _tokenize_chunk(filename, chunk):
+    start, end = chunk
+    with open(filename, "rb") as f:
+        f.seek(start)
+        lines = f.read(end - start).decode().split("\n")
+
+    # share repeated names so they are pickled only once per chunk
+    names = {}
+    tokens = []
+    for op, session, tx, key, read_from_session, read_from in tokenize_log(lines):
+        tokens.append((op, names.setdefault(session, session), names.setdefault(tx, tx), names.setdefault(key, key),
+                       names.setdefault(read_from_session, read_from_session), names.setdefault(read_from, read_from)))
+
+    return tokens
+
+def tokenize_log_parallel(filename, jobs):
+    # tokenizes chunks of an uncompressed text trace in parallel, yielding operations in trace order
+    chunks = _chunk_offsets(filename, jobs)
+    if len(chunks) == 1:
+        with open(filename) as f:
+            yield from tokenize_log(f)
+        return
 
-                # parse the read_from tx for session info
-                tx_info_read_from = re.search("(.+?), (.+?)", from_tx)
-                read_from_session = tx_info_read_from.group(1)
-                seq_read_from = tx_info_read_from.group(2)
+    with multiprocessing.Pool(min(jobs, len(chunks))) as p:
+        for tokens in p.imap(functools.partial(_tokenize_chunk, filename), chunks):
+            yield from tokens
 
-                set_op = "Set(%s:%s)"%(set_key, data_key)
-                
-                db.add_read(session, tx, set_op, from_tx, read_from_session)
-
-                # skip the remaining regex matching
-                continue
+def parse_log(filename, jobs=1, use_cache=False):
+    in_file = filename.split("/")[-1]
+    in_file = in_file.split(".")[0]
 
-            delete = re.search("DELETE\[(.+?)\] from Set\[(.+?)\] Txn\((.+?)\)", line)
-            if delete:
-                data_key = delete.group(1)
-                set_key = delete.group(2)
-                tx = delete.group(3)
-                
-                # parse tx for session info
-                tx_info = re.search("(.+?), (.+?)", tx)
-                session = tx_info.group(1)
-                seq = tx_info.group(2)
+    if use_cache:
+        cached = cache.cache_path(filename)
+        db = cache.load(cached)
+        if db is not None:
+            print("Loaded cached log file: %s"%filename)
 
-                set_op = "Set(%s:%s)"%(set_key, data_key)
+            # entries are shared by traces with the same content
+            db.in_file = in_file
+            return db
 
-                db.add_write(session, tx, set_op)
+    db = DataStore(in_file)
 
-                continue
+    print("Parsing log file: %s"%filename)
+    if tracefile.is_trace_file(filename):
+        db.add_operations(tracefile.read_log(filename))
+    elif jobs > 1 and not tracefile.is_compressed(filename):
+        # operations are replayed in trace order, so the result is the same as parsing sequentially
+        db.add_operations(tokenize_log_parallel(filename, jobs))
+    else:
+        try:
+            f = tracefile.open_text(filename)
+        except ImportError as e:
+            print("[Error] %s"%e)
+            return None
+
+        with f:
+            db.add_operations(tokenize_log(f))
 
     db.add_initial_state()
     # db.add_final_state()
@@ -650,4 +1126,7 @@ def parse_log(filename):
         
         return None
 
-    return db
\ No newline at end of file
+    if use_cache:
+        cache.store(cached, db)
+
+    return db
@@ -1,52 +1,312 @@
+import heapq
 import graphviz
 
+def transitive_closure(successors):
+    # successors[i] is the bitset of direct successors of node i, returns the bitsets of nodes reachable from every node
+    reach = list(successors)
+    for k in range(len(reach)):
+        bit = 1 << k
+        reach_k = reach[k]
+        for i in range(len(reach)):
+            if reach[i] & bit:
+                reach[i] |= reach_k
+
+    return reach
+
+def components(nodes, edges):
+    # connected components of the undirected graph, each a list of nodes in the order of nodes
+    parent = {node: node for node in nodes}
+
+    def find(node):
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    for src, dst in edges:
+        parent[find(src)] = find(dst)
+
+    groups = {}
+    for node in nodes:
+        root = find(node)
+        if root not in groups:
+            groups[root] = []
+        groups[root].append(node)
+
+    return list(groups.values())
+
+class Reachability:
+    # transitive closure of the edges between nodes, acyclic tells whether the edges form no cycle
+    def __init__(self, nodes, edges):
+        self.index = {node: i for i, node in enumerate(nodes)}
+        successors = [[] for _ in self.index]
+        loops = []
+        for src, dst in edges:
+            i, j = self.index[src], self.index[dst]
+            if i == j:
+                loops.append(i)
+            else:
+                successors[i].append(j)
+
+        # apart from self loops, an acyclic graph is closed along a reverse topological order,
+        # every node reaching what its successors reach
+        order = _topological_indices(successors)
+        self.acyclic = len(order) == len(successors) and not loops
+        if len(order) == len(successors):
+            reach = [0] * len(successors)
+            for i in reversed(order):
+                r = 0
+                for j in successors[i]:
+                    r |= reach[j] | (1 << j)
+                reach[i] = r
+            for i in loops:
+                reach[i] |= 1 << i
+        else:
+            bits = [0] * len(successors)
+            for i, succ in enumerate(successors):
+                for j in succ:
+                    bits[i] |= 1 << j
+            for i in loops:
+                bits[i] |= 1 << i
+            reach = transitive_closure(bits)
+
+        self.reach = reach
+
+    def __call__(self, src, dst):
+        return (self.reach[self.index[src]] >> self.index[dst]) & 1 == 1
+
+def _topological_indices(successors):
+    # indices of the nodes ordered along the edges, only those not on or behind a cycle
+    indegree = [0] * len(successors)
+    for succ in successors:
+        for j in succ:
+            indegree[j] += 1
+
+    ready = [i for i in range(len(successors)) if indegree[i] == 0]
+    order = []
+    while ready:
+        i = ready.pop()
+        order.append(i)
+        for j in successors[i]:
+            indegree[j] -= 1
+            if indegree[j] == 0:
+                ready.append(j)
+
+    return order
+
+def topological_order(nodes, edges):
+    # nodes ordered along the edges, ties keep the order of nodes
+    index = {node: i for i, node in enumerate(nodes)}
+    successors = [[] for _ in index]
+    indegree = [0] * len(index)
+    for src, dst in edges:
+        successors[index[src]].append(index[dst])
+        indegree[index[dst]] += 1
+
+    ready = [i for i in range(len(index)) if indegree[i] == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        i = heapq.heappop(ready)
+        order.append(nodes[i])
+        for j in successors[i]:
+            indegree[j] -= 1
+            if indegree[j] == 0:
+                heapq.heappush(ready, j)
+
+    return order
+
+class IncrementalOrder:
+    # topological order of an acyclic graph whose edges come and go, after Pearce and Kelly
+    def __init__(self, nodes):
+        self.ord = {node: i for i, node in enumerate(nodes)}
+        self.succ = {node: {} for node in self.ord}
+        self.pred = {node: {} for node in self.ord}
+
+    def add_edge(self, src, dst, label):
+        # adds the edge and returns None, or returns the labels of the cycle it would close
+        if src == dst:
+            return [label]
+
+        labels = self.succ[src].get(dst)
+        if labels:
+            labels.append(label)
+            return None
+
+        lower, upper = self.ord[dst], self.ord[src]
+        if lower < upper:
+            # nodes between dst and src in the order that dst reaches
+            parent = {dst: None}
+            todo = [dst]
+            while todo:
+                node = todo.pop()
+                for succ in self.succ[node]:
+                    if succ == src:
+                        return self._cycle(parent, node, src, dst, label)
+                    if succ not in parent and self.ord[succ] < upper:
+                        parent[succ] = node
+                        todo.append(succ)
+            forward = list(parent)
+
+            # nodes between dst and src in the order that reach src
+            backward = {src}
+            todo = [src]
+            while todo:
+                node = todo.pop()
+                for pred in self.pred[node]:
+                    if pred not in backward and self.ord[pred] > lower:
+                        backward.add(pred)
+                        todo.append(pred)
+
+            # move the nodes reaching src before the nodes reached from dst, reusing their positions
+            forward.sort(key=self.ord.get)
+            backward = sorted(backward, key=self.ord.get)
+            positions = sorted(self.ord[node] for node in backward + forward)
+            for node, i in zip(backward + forward, positions):
+                self.ord[node] = i
+
+        self.succ[src][dst] = [label]
+        self.pred[dst][src] = True
+        return None
+
+    def _cycle(self, parent, node, src, dst, label):
+        # labels along dst ->* node -> src -> dst
+        cycle = [self.succ[node][src][0], label]
+        while parent[node] is not None:
+            cycle.append(self.succ[parent[node]][node][0])
+            node = parent[node]
+
+        return cycle
+
+    def remove_edge(self, src, dst):
+        # removes the label added last, an order stays valid when edges disappear
+        labels = self.succ[src][dst]
+        labels.pop()
+        if not labels:
+            del self.succ[src][dst]
+            del self.pred[dst][src]
+
 class Graph:
     def __init__(self, title=None):
         self.title = title if title else "SerializationGraph"
-        self.graph = {} # adjacency list
+        self.index = {} # key: node  value: integer id
+        self.nodes = [] # key: integer id  value: node
+        self.successors = [] # key: integer id  value: integer ids of successors
+        self.edges = set()
         self.dot = graphviz.Digraph(comment=title)
 
     def add_edge(self, src, dst, comment=None):
-        self.add_node(src)
-        self.add_node(dst)
+        i = self.add_node(src)
+        j = self.add_node(dst)
 
-        if dst not in self.graph[src] and src != dst:
-            self.graph[src].append(dst)
+        if (i, j) not in self.edges and i != j:
+            self.edges.add((i, j))
+            self.successors[i].append(j)
             self.dot.edge(src, dst, comment)
 
     def add_node(self, node):
-        if node not in self.graph:
-            self.graph[node] = []
+        if node not in self.index:
+            self.index[node] = len(self.nodes)
+            self.nodes.append(node)
+            self.successors.append([])
             self.dot.node(node)
 
+        return self.index[node]
+
+    def cycles(self):
+        # every strongly connected component with more than one node, with a shortest cycle through its first node,
+        # the cycle starts and ends with that node
+        result = []
+        for component in _strongly_connected_indices(self.successors):
+            if len(component) > 1:
+                cycle = _shortest_cycle(self.successors, component)
+                result.append(([self.nodes[i] for i in component], [self.nodes[i] for i in cycle]))
+
+        return result
+
     def find_cycle(self):
-        nodes = list(self.graph.keys())
-        if len(nodes) == 0:
+        if len(self.nodes) == 0:
             print("Error: Empty graph")
             return []
 
-        visited = dict(zip(nodes, [False] * len(nodes)))
-        to_visit = [(nodes[0], [])]
+        cycles = self.cycles()
+        return cycles[0][1] if cycles else []
+
+    def visualize(self):
+        self.dot.render("out/{}".format(self.title), view=False)
 
-        while to_visit:
-            (curr, parents) = to_visit.pop()
-            
-            if curr in parents:
-                return parents + [curr]
+def _strongly_connected_indices(successors):
+    # strongly connected components after Tarjan, without recursion, each a list of indices
+    index = [None] * len(successors)
+    low = [0] * len(successors)
+    on_stack = [False] * len(successors)
+    stack = []
+    components = []
+    counter = 0
 
-            if curr in visited and visited[curr]:
+    for root in range(len(successors)):
+        if index[root] is not None:
+            continue
+
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)]
+        while work:
+            i, pos = work[-1]
+            if pos < len(successors[i]):
+                work[-1] = (i, pos + 1)
+                j = successors[i][pos]
+                if index[j] is None:
+                    index[j] = low[j] = counter
+                    counter += 1
+                    stack.append(j)
+                    on_stack[j] = True
+                    work.append((j, 0))
+                elif on_stack[j] and index[j] < low[i]:
+                    low[i] = index[j]
                 continue
 
-            visited[curr] = True
+            work.pop()
+            if work and low[i] < low[work[-1][0]]:
+                low[work[-1][0]] = low[i]
 
-            neighbors = list(map(
-                lambda a: (a, parents + [curr]),
-                self.graph[curr]
-            ))
-            
-            for n in neighbors:
-                to_visit.append(n)
-        return []
+            if low[i] == index[i]:
+                component = []
+                while True:
+                    j = stack.pop()
+                    on_stack[j] = False
+                    component.append(j)
+                    if j == i:
+                        break
+                component.reverse()
+                components.append(component)
 
-    def visualize(self):
-        self.dot.render("out/{}".format(self.title), view=False)
\ No newline at end of file
+    return components
+
+def _shortest_cycle(successors, component):
+    # breadth-first search inside the component from its first node back to it
+    start = component[0]
+    inside = set(component)
+    parent = {start: None}
+    frontier = [start]
+    while frontier:
+        following = []
+        for i in frontier:
+            for j in successors[i]:
+                if j == start:
+                    cycle = [start]
+                    while i is not None:
+                        cycle.append(i)
+                        i = parent[i]
+                    cycle.reverse()
+                    return cycle
+                if j in inside and j not in parent:
+                    parent[j] = i
+                    following.append(j)
+        frontier = following
+
+    return []
@@ -0,0 +1,57 @@
+import multiprocessing
+from z3 import *
+import isopredict.portfolio as portfolio
+
+# cubes per worker, so that workers finishing early can take over the remaining cubes
+CUBES_PER_WORKER = 8
+
+# solver of a worker process, holding the assertions shared by all cubes
+_solver = None
+
+def _init(assertions, timeout):
+    global _solver
+    _solver = Solver()
+    _solver.set("timeout", timeout)
+    _solver.from_string(assertions)
+
+def _solve_cube(task):
+    index, cube = task
+
+    # the declarations of the cube's terms come with the shared assertions
+    _solver.push()
+    _solver.from_string(cube)
+    res = _solver.check()
+    model = portfolio.model_assertion(_solver) if res == sat else None
+    _solver.pop()
+
+    return index, str(res), model
+
+def check(s, cubes, workers, timeout=3600000 * 2):
+    # solves s under every cube (a list of constraints) in workers processes, stopping at the first sat cube;
+    # returns the result, a model of s when sat, and the index of the sat cube
+    ctx = multiprocessing.get_context("spawn")
+    tasks = [(i, "(assert %s)"%And(cube).sexpr()) for i, cube in enumerate(cubes)]
+
+    res, model, winner = unsat, None, None
+    with ctx.Pool(workers, initializer=_init, initargs=(s.sexpr(), timeout)) as pool:
+        for index, verdict, cube_model in pool.imap_unordered(_solve_cube, tasks):
+            if verdict == "sat":
+                res, model, winner = sat, cube_model, index
+                break
+
+            # the cubes cover every boundary, so one undecided cube leaves the whole query undecided
+            if verdict != "unsat":
+                res = unknown
+
+        # the remaining cubes are still solving
+        pool.terminate()
+
+    if res != sat:
+        return res, None, None
+
+    m = portfolio.replay(s, model)
+    if m is None:
+        print("[Error] cannot replay the model of cube %d"%winner)
+        return unknown, None, winner
+
+    return res, m, winner
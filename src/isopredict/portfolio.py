@@ -0,0 +1,141 @@
+import multiprocessing
+import queue
+from z3 import *
+
+# raced solver settings, configuration 0 is z3's default
+ARITH_SOLVERS = [6, 2]
+TACTICS = [None, ["simplify", "propagate-values", "solve-eqs", "smt"]]
+
+def configuration(i):
+    return {"seed": i, "arith": ARITH_SOLVERS[i % len(ARITH_SOLVERS)], "tactic": TACTICS[(i // len(ARITH_SOLVERS)) % len(TACTICS)]}
+
+def describe(config):
+    tactic = ",".join(config["tactic"]) if config["tactic"] is not None else "default"
+    return "seed=%d arith=%d tactic=%s"%(config["seed"], config["arith"], tactic)
+
+def uninterpreted_terms(exprs):
+    # uninterpreted constants and function applications in exprs, including the free ones under quantifiers
+    terms = {}
+    visited = set()
+    todo = list(exprs)
+    while todo:
+        e = todo.pop()
+        if e.get_id() in visited:
+            continue
+        visited.add(e.get_id())
+
+        if is_quantifier(e):
+            todo.append(e.body())
+        elif is_app(e):
+            children = e.children()
+            if e.decl().kind() == Z3_OP_UNINTERPRETED:
+                # applications to bound variables have no single value
+                if not any(is_var(c) for c in children):
+                    terms[e.get_id()] = e
+                continue
+
+            todo.extend(children)
+
+    return list(terms.values())
+
+def _solve(index, config, assertions, timeout, results):
+    set_param("smt.random_seed", config["seed"])
+    set_param("sat.random_seed", config["seed"])
+    set_param("smt.arith.solver", config["arith"])
+
+    if config["tactic"] is None:
+        s = Solver()
+    else:
+        s = Then(*config["tactic"]).solver()
+    s.set("timeout", timeout)
+
+    try:
+        s.from_string(assertions)
+        res = s.check()
+    except Z3Exception as e:
+        print("[Error] portfolio configuration %s failed: %s"%(describe(config), e))
+        results.put((index, "unknown", None))
+        return
+
+    model = model_assertion(s) if res == sat else None
+    results.put((index, str(res), model))
+
+def model_assertion(s):
+    # the model of s as an assertion over the terms of its assertions, to be sent to another process
+    m = s.model()
+    values = ["(= %s %s)"%(t.sexpr(), m.eval(t, model_completion=True).sexpr()) for t in uninterpreted_terms(s.assertions())]
+
+    return "(assert (and true %s))"%" ".join(values)
+
+def _declarations(terms):
+    # declarations and sorts needed to parse a model of terms
+    decls = {}
+    sorts = {}
+    for t in terms:
+        d = t.decl()
+        decls[d.name()] = d
+
+        # the constructors of a datatype come with its sort
+        for sort in [d.range()] + [d.domain(i) for i in range(d.arity())]:
+            if isinstance(sort, DatatypeSortRef):
+                sorts[sort.name()] = sort
+
+    return sorts, decls
+
+def check(s, workers, timeout=3600000 * 2):
+    # races workers solver configurations on the assertions of s, returns the first sat or unsat,
+    # a model of s when sat, and the winning configuration
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    assertions = s.sexpr()
+
+    processes = []
+    for i in range(workers):
+        p = ctx.Process(target=_solve, args=(i, configuration(i), assertions, timeout, results), daemon=True)
+        p.start()
+        processes.append(p)
+
+    res, model, winner = unknown, None, None
+    pending = workers
+    try:
+        while pending > 0:
+            try:
+                index, verdict, model = results.get(timeout=1)
+            except queue.Empty:
+                # workers that died without an answer
+                if not any(p.is_alive() for p in processes) and results.empty():
+                    break
+                continue
+
+            pending -= 1
+            if verdict in ("sat", "unsat"):
+                res = sat if verdict == "sat" else unsat
+                winner = configuration(index)
+                break
+    finally:
+        # the losers are still solving
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+        for p in processes:
+            p.join()
+
+    if res != sat:
+        return res, None, winner
+
+    m = replay(s, model)
+    if m is None:
+        print("[Error] cannot replay the model of portfolio configuration %s"%describe(winner))
+        return unknown, None, winner
+
+    return res, m, winner
+
+def replay(s, model):
+    # a model of s from model_assertion; all of its terms are fixed, so this check is cheap
+    sorts, decls = _declarations(uninterpreted_terms(s.assertions()))
+    s.push()
+    s.add(parse_smt2_string(model, sorts=sorts, decls=decls))
+    m = s.model() if s.check() == sat else None
+    s.pop()
+
+    return m
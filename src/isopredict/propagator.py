@@ -0,0 +1,70 @@
+from z3 import *
+import isopredict.graph as graph
+
+class AcyclicityPropagator(UserPropagateBase):
+    # keeps the edges whose literals are assigned true acyclic, so that a commit order extending them exists
+    def __init__(self, s, nodes, name, ctx=None):
+        super().__init__(s, ctx)
+        self.nodes = list(nodes)
+        self.name = name
+        self.order = graph.IncrementalOrder(self.nodes)
+
+        # edges by the names of their literals, which are kept when a literal is copied to another context
+        self.edges = {}
+        self.literals = {}
+
+        # edges added to the order, and the number of them at every scope
+        self.trail = []
+        self.scopes = []
+
+        self.add_fixed(self._fixed)
+
+    def edge(self, src, dst):
+        # literal of the edge src -> dst, which the commit order must contain when it is true
+        if (src, dst) not in self.literals:
+            literal = Bool("%s-Before[%s][%s]"%(self.name, src, dst))
+            self.literals[(src, dst)] = literal
+            self.edges[literal.decl().name()] = (src, dst)
+            self.add(literal)
+
+        return self.literals[(src, dst)]
+
+    def reset(self, name):
+        # the solver forgets literals registered inside a popped scope, the next query registers its literals again
+        self.name = name
+        self.literals = {}
+
+    def push(self):
+        self.scopes.append(len(self.trail))
+
+    def pop(self, num_scopes):
+        size = self.scopes[-num_scopes]
+        del self.scopes[-num_scopes:]
+
+        while len(self.trail) > size:
+            self.order.remove_edge(*self.trail.pop())
+
+    def fresh(self, new_ctx):
+        # auxiliary solvers, e.g. for quantifier instantiation, register copies of the same literals
+        propagator = AcyclicityPropagator(None, self.nodes, self.name, new_ctx)
+        propagator.edges = self.edges
+
+        return propagator
+
+    def _fixed(self, literal, value):
+        if not is_true(value):
+            return
+
+        src, dst = self.edges[literal.decl().name()]
+        cycle = self.order.add_edge(src, dst, literal)
+        if cycle is None:
+            self.trail.append((src, dst))
+        else:
+            # the edges of the cycle cannot be true together
+            self.conflict(cycle)
+
+    def commit_order(self, m):
+        # transactions in an order that extends every edge true in model m
+        edges = [(src, dst) for (src, dst), literal in self.literals.items() if is_true(m.eval(literal, model_completion=True))]
+
+        return graph.topological_order(self.nodes, edges)
@@ -9,6 +9,10 @@ COL_TX = "Total Transactions"
 COL_GENCON = "Constraint Generation"
 COL_SOLVE = "Constraint Solving"
 COL_LITERAL = "SMT Literals"
+COL_CONSTRAINT = "SMT Constraints"
+COL_CONFIGURATION = "Solver Configuration"
+COL_REDUCED_EVENT = "Reduced Events"
+COL_REDUCTION = "Trace Reduction"
 
 class Stats:
     def __init__(self, stats_dir, output):
@@ -24,6 +28,10 @@ class Stats:
 
         print("Avg. constraint generation time: %.1f"%self.df[COL_GENCON].mean())
 
+        # older runs do not record the number of constraints
+        if COL_CONSTRAINT in self.df:
+            print("Avg. number of constraints: %.1f"%pd.to_numeric(self.df[COL_CONSTRAINT], errors="coerce").mean())
+
         if sat[COL_NAME].count() != 0:
             print("Avg. solving time (sat): %.1f"%sat[COL_SOLVE].mean())
 
@@ -32,6 +40,35 @@ class Stats:
 
         if unknown[COL_NAME].count() != 0:
             print("Avg. solving time (unknown): %.1f"%unknown[COL_SOLVE].mean())
+
+        # winning configurations of portfolio runs, the sat cube of a cube run is specific to its trace
+        if COL_CONFIGURATION in self.df:
+            portfolio = (self.df[COL_CONFIGURATION] != "N/A") & ~self.df[COL_CONFIGURATION].astype(str).str.startswith("cube")
+            wins = self.df.loc[portfolio, COL_CONFIGURATION].value_counts()
+            for config, count in wins.items():
+                print("Portfolio wins of %s: %d"%(config, count))
+
+        # share of the events a reduced trace keeps
+        if COL_REDUCED_EVENT in self.df:
+            reduced = pd.to_numeric(self.df[COL_REDUCED_EVENT], errors="coerce")
+            if reduced.count() != 0:
+                print("Avg. events kept by reduction: %.1f%%"%(100 * (reduced / self.df[COL_EVENT]).mean()))
+
+    def print_speedup(self, baseline_dir):
+        # events kept by the reduction and speedup of every benchmark over a run of the same traces without it
+        baseline = parse_csv(baseline_dir)[[COL_NAME, COL_GENCON, COL_SOLVE]]
+        df = self.df.merge(baseline, on=COL_NAME, suffixes=("", " (baseline)"))
+
+        for _, row in df.sort_values(COL_NAME).iterrows():
+            reduction = pd.to_numeric(row.get(COL_REDUCTION, "N/A"), errors="coerce")
+            elapsed = row[COL_GENCON] + row[COL_SOLVE] + (0 if pd.isna(reduction) else reduction)
+            elapsed_baseline = row[COL_GENCON + " (baseline)"] + row[COL_SOLVE + " (baseline)"]
+
+            reduced = pd.to_numeric(row.get(COL_REDUCED_EVENT, "N/A"), errors="coerce")
+            events = row[COL_EVENT] if pd.isna(reduced) else reduced
+            speedup = elapsed_baseline / elapsed if elapsed > 0 else float("inf")
+
+            print("%s: %d/%d events, %.2fx speedup"%(row[COL_NAME], events, row[COL_EVENT], speedup))
         
 
     def to_tex_cmd(self):
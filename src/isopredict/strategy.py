@@ -29,9 +29,18 @@ class EnumAction(argparse.Action):
 
 class Strategy(enum.Enum):
     Full = "full"
+    FullQF = "full-qf"
     Express = "express"
     Relaxed = "relaxed"
 
 class Consistency(enum.Enum):
     Causal = "causal"
-    ReadCommitted = "readcommitted"
\ No newline at end of file
+    ReadCommitted = "readcommitted"
+
+class Encoding(enum.Enum):
+    Dense = "dense"
+    Sparse = "sparse"
+
+class Acyclicity(enum.Enum):
+    Arithmetic = "arithmetic"
+    Propagator = "propagator"
@@ -0,0 +1,165 @@
+import array
+import gzip
+import io
+import lzma
+import mmap
+import struct
+import sys
+
+# Binary trace format, all integers are little endian
+#   header:  magic, version, number of sessions, transactions, keys and operations
+#   tables:  session, transaction and key names, each table is a u64 byte length
+#            followed by the newline separated utf-8 names, padded to 4 bytes
+#   columns: session id of every transaction (u32), then one column per operation field:
+#            transaction id (u32), key id (u32), read-from transaction id (u32), op code (u8)
+MAGIC = b"ISOTRACE"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIQ")
+TABLE_SIZE = struct.Struct("<Q")
+NO_TX = 0xFFFFFFFF
+EXTENSION = ".isotrace"
+
+# magic numbers of compressed text traces
+GZIP_MAGIC = b"\x1f\x8b"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# read size for compressed traces
+BUFFER_SIZE = 1 << 20
+
+def _magic(filename):
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC))
+
+def is_trace_file(filename):
+    return _magic(filename) == MAGIC
+
+def is_compressed(filename):
+    magic = _magic(filename)
+    return any(magic.startswith(m) for m in (GZIP_MAGIC, XZ_MAGIC, ZSTD_MAGIC))
+
+def open_text(filename):
+    # opens a text trace, decompressing gzip, xz and zstd traces on the fly
+    magic = _magic(filename)
+
+    if magic.startswith(GZIP_MAGIC):
+        raw = gzip.GzipFile(filename, "rb")
+    elif magic.startswith(XZ_MAGIC):
+        raw = lzma.LZMAFile(filename, "rb")
+    elif magic.startswith(ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("reading zstd compressed traces requires the zstandard package")
+
+        raw = zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), read_size=BUFFER_SIZE, read_across_frames=True, closefd=True)
+    else:
+        return open(filename)
+
+    return io.TextIOWrapper(io.BufferedReader(raw, buffer_size=BUFFER_SIZE))
+
+def _padding(size):
+    return -size % 4
+
+def _column_bytes(code, values):
+    column = array.array(code, values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column.tobytes()
+
+def _column(buf, pos, code, n):
+    # zero-copy view into the mapped file whenever the byte order allows it
+    size = array.array(code).itemsize * n
+    if sys.byteorder == "little":
+        return buf[pos:pos + size].cast(code), pos + size
+
+    column = array.array(code, buf[pos:pos + size].tobytes())
+    column.byteswap()
+    return column, pos + size
+
+def _table(buf, pos, n):
+    (size,) = TABLE_SIZE.unpack_from(buf, pos)
+    pos += TABLE_SIZE.size
+    names = str(buf[pos:pos + size], "utf-8").split("\n") if n > 0 else []
+    return names, pos + size + _padding(size)
+
+def write_log(filename, operations):
+    # operations are (op, session, transaction, key, read_from_session, read_from_tx) tuples
+    sessions = {}
+    transactions = {}
+    keys = {}
+    tx_session = []
+    ops = array.array("B")
+    tx_column = []
+    key_column = []
+    read_from_column = []
+
+    def tx_index(session, tx):
+        if tx not in transactions:
+            if session not in sessions:
+                sessions[session] = len(sessions)
+            transactions[tx] = len(transactions)
+            tx_session.append(sessions[session])
+        return transactions[tx]
+
+    for op, session, tx, key, read_from_session, read_from in operations:
+        if key not in keys:
+            keys[key] = len(keys)
+
+        ops.append(op)
+        tx_column.append(tx_index(session, tx))
+        key_column.append(keys[key])
+        read_from_column.append(NO_TX if read_from is None else tx_index(read_from_session, read_from))
+
+    with open(filename, "wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, len(sessions), len(transactions), len(keys), len(ops)))
+
+        for table in (sessions, transactions, keys):
+            data = "\n".join(table.keys()).encode("utf-8")
+            out.write(TABLE_SIZE.pack(len(data)))
+            out.write(data)
+            out.write(b"\0" * _padding(len(data)))
+
+        out.write(_column_bytes("I", tx_session))
+        out.write(_column_bytes("I", tx_column))
+        out.write(_column_bytes("I", key_column))
+        out.write(_column_bytes("I", read_from_column))
+        out.write(ops.tobytes())
+
+    return len(ops)
+
+def read_log(filename):
+    # yields the same operations as datastore.tokenize_log, straight from the memory-mapped file
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        buf = memoryview(mapped)
+        columns = []
+
+        try:
+            magic, version, n_sessions, n_tx, n_keys, n_ops = HEADER.unpack_from(buf, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("unsupported trace file: %s"%filename)
+
+            pos = HEADER.size
+            session_names, pos = _table(buf, pos, n_sessions)
+            tx_names, pos = _table(buf, pos, n_tx)
+            key_names, pos = _table(buf, pos, n_keys)
+
+            for code, n in (("I", n_tx), ("I", n_ops), ("I", n_ops), ("I", n_ops), ("B", n_ops)):
+                column, pos = _column(buf, pos, code, n)
+                columns.append(column)
+            tx_session, tx_column, key_column, read_from_column, ops = columns
+
+            # session name of every transaction
+            tx_session_names = [session_names[s] for s in tx_session]
+
+            for op, tx, key, read_from in zip(ops, tx_column, key_column, read_from_column):
+                if read_from == NO_TX:
+                    yield (op, tx_session_names[tx], tx_names[tx], key_names[key], None, None)
+                else:
+                    yield (op, tx_session_names[tx], tx_names[tx], key_names[key], tx_session_names[read_from], tx_names[read_from])
+        finally:
+            # views must be released before the file is unmapped
+            for column in columns:
+                if isinstance(column, memoryview):
+                    column.release()
+            buf.release()
@@ -1,10 +1,11 @@
 from z3 import *
 import isopredict.datastore as datastore
-from isopredict.strategy import Consistency
+import isopredict.graph as graph
+from isopredict.strategy import Consistency, Encoding
 
 class Verifier(datastore.Symbolic):
-    def __init__(self, db, visualize=False, debug=False, consistency=Consistency.Causal, output="./out"):
-        super().__init__(db, output)
+    def __init__(self, db, visualize=False, debug=False, consistency=Consistency.Causal, output="./out", encoding=Encoding.Dense):
+        super().__init__(db, output, encoding)
 
         # configurations
         self.consistency = consistency
@@ -150,6 +151,18 @@ class Verifier(datastore.Symbolic):
         # rwk constraints
         rwk_candidates = {k: self.prepare_rwk_candidates(k) for k in self.rwk.keys()}
 
+        if self.encoding == Encoding.Sparse:
+            for k in rwk_candidates:
+                constraints += self.sparse_constraints(self.rwk[k], rwk_candidates[k])
+            constraints += self.sparse_union_constraints(self.rw, self.rwk)
+
+            # Causal constraints
+            for tx1_id, tx2_id, tx1, tx2 in self.related_pairs(self.wr, self.so, self.ar):
+                constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2), self.ar(tx1, tx2)),
+                                           co[tx1_id] < co[tx2_id]))
+
+            return And(constraints)
+
         for tx1_id, tx1 in self.tx.items():
             for tx2_id, tx2 in self.tx.items():
                 if tx1_id == tx2_id:
@@ -237,6 +250,18 @@ class Verifier(datastore.Symbolic):
                         
         # rwk constraints
         rwk_candidates = {k: self.prepare_rwk_candidates(k) for k in self.rwk.keys()}
+
+        if self.encoding == Encoding.Sparse:
+            for k in rwk_candidates:
+                constraints += self.sparse_constraints(self.rwk[k], rwk_candidates[k])
+            constraints += self.sparse_union_constraints(self.rw, self.rwk)
+
+            # write-read and session-order
+            for tx1_id, tx2_id, tx1, tx2 in self.related_pairs(self.wr, self.so):
+                constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2)),
+                                           co[tx1_id] < co[tx2_id]))
+
+            return And(constraints)
         
         # preserving write-read and session-order
         for tx1_id, tx1 in self.tx.items():
@@ -306,6 +331,18 @@ class Verifier(datastore.Symbolic):
         # for c in co.values():
         #     constraints.append(And(c >= 0, c < total_tx))
 
+        if self.encoding == Encoding.Sparse:
+            for k in wwk_candidates:
+                constraints += self.sparse_constraints(self.wwk[k], wwk_candidates[k])
+            constraints += self.sparse_union_constraints(self.ww, self.wwk)
+
+            # serializability
+            for tx1_id, tx2_id, tx1, tx2 in self.related_pairs(self.wr, self.so, self.ww):
+                constraints.append(Implies(Or(self.wr(tx1, tx2), self.so(tx1, tx2), self.ww(tx1, tx2)),
+                                           co[tx1_id] < co[tx2_id]))
+
+            return And(constraints)
+
         # generate ww constraints
         for tx1_id, tx1 in self.tx.items():
             for tx2_id, tx2 in self.tx.items():
@@ -347,48 +384,55 @@ class Verifier(datastore.Symbolic):
         # ark constraints
         ark_candidates = {k: self.prepare_ark_candidates(k) for k in self.ark.keys()}
 
-        # so, wr, hb, ar constraints
-        for tx1_id, tx1 in self.tx.items():
-            for tx2_id, tx2 in self.tx.items():
-                if tx1_id == tx2_id:
-                    s.add(Not(self.so(tx1, tx2)))
-                    s.add(Not(self.wr(tx1, tx2)))
-                    s.add(Not(self.hb(tx1, tx2)))
-                    s.add(Not(self.ar(tx1, tx2)))
-                    continue
+        # happens-before is the transitive closure of the observed session order and write-read
+        hb_edges = list(so_candidates.keys())
+        for k in wrk_candidates:
+            hb_edges += wrk_candidates[k].keys()
+        s.add(self.bounded_hb_constraints(hb_edges, hb_edges))
+
+        # so, wr, ar constraints
+        if self.encoding == Encoding.Sparse:
+            s.add(self.sparse_constraints(self.so, so_candidates, BoolVal))
+            for k in wrk_candidates:
+                s.add(self.sparse_constraints(self.wrk[k], wrk_candidates[k], BoolVal))
+            s.add(self.sparse_union_constraints(self.wr, self.wrk))
+            for k in ark_candidates:
+                s.add(self.sparse_constraints(self.ark[k], ark_candidates[k]))
+            s.add(self.sparse_union_constraints(self.ar, self.ark))
+        else:
+            for tx1_id, tx1 in self.tx.items():
+                for tx2_id, tx2 in self.tx.items():
+                    if tx1_id == tx2_id:
+                        s.add(Not(self.so(tx1, tx2)))
+                        s.add(Not(self.wr(tx1, tx2)))
+                        s.add(Not(self.ar(tx1, tx2)))
+                        continue
                 
-                # session order constraints
-                if (tx1_id, tx2_id) in so_candidates:
-                    s.add(self.so(tx1, tx2))
-                else:
-                    s.add(Not(self.so(tx1, tx2)))
-
-                # write-read over k constraints
-                for k in wrk_candidates:
-                    if (tx1_id, tx2_id) in wrk_candidates[k]:
-                        s.add(self.wrk[k](tx1, tx2))
-                    else:
-                        s.add(Not(self.wrk[k](tx1, tx2)))
-
-                # write-read
-                s.add(self.wr(tx1, tx2) == Or(list(wrx(tx1, tx2) for wrx in self.wrk.values())))
-
-                # happens-before transitive closure
-                hb_constraints = [self.wr(tx1, tx2), self.so(tx1, tx2)]
-                for tx3_id, tx3 in self.tx.items():
-                    if tx3_id != tx1_id and tx3_id != tx2_id:
-                        hb_constraints.append(And(self.hb(tx1, tx3), Or(self.wr(tx3, tx2), self.so(tx3, tx2))))
-                s.add(self.hb(tx1, tx2) == Or(hb_constraints))
-
-                # causal arbitration over k
-                for k in ark_candidates:
-                    if (tx1_id, tx2_id) in ark_candidates[k]:
-                        s.add(self.ark[k](tx1, tx2) == Or(ark_candidates[k][(tx1_id, tx2_id)]))
+                    # session order constraints
+                    if (tx1_id, tx2_id) in so_candidates:
+                        s.add(self.so(tx1, tx2))
                     else:
-                        s.add(Not(self.ark[k](tx1, tx2)))
+                        s.add(Not(self.so(tx1, tx2)))
+
+                    # write-read over k constraints
+                    for k in wrk_candidates:
+                        if (tx1_id, tx2_id) in wrk_candidates[k]:
+                            s.add(self.wrk[k](tx1, tx2))
+                        else:
+                            s.add(Not(self.wrk[k](tx1, tx2)))
 
-                # causal arbitration
-                s.add(self.ar(tx1, tx2) == Or(list(arx(tx1, tx2) for arx in self.ark.values())))
+                    # write-read
+                    s.add(self.wr(tx1, tx2) == Or(list(wrx(tx1, tx2) for wrx in self.wrk.values())))
+
+                    # causal arbitration over k
+                    for k in ark_candidates:
+                        if (tx1_id, tx2_id) in ark_candidates[k]:
+                            s.add(self.ark[k](tx1, tx2) == Or(ark_candidates[k][(tx1_id, tx2_id)]))
+                        else:
+                            s.add(Not(self.ark[k](tx1, tx2)))
+
+                    # causal arbitration
+                    s.add(self.ar(tx1, tx2) == Or(list(arx(tx1, tx2) for arx in self.ark.values())))
 
         # visualization after an s.check() here
         res = s.check()
@@ -448,4 +492,185 @@ class Verifier(datastore.Symbolic):
         if self.debug:
             self.print_model(m)
 
-        return res
\ No newline at end of file
+        return res
+
+class ConcreteChecker:
+    # decides the same questions as Verifier on the graph of the observed execution, where so and wr are known:
+    # the weak isolation level holds when its edges are acyclic, and serializability is a polygraph whose
+    # write-write orders are forced by reachability where possible, only the remaining ones are left to the solver
+    def __init__(self, db, consistency=Consistency.Causal):
+        self.db = db
+        self.consistency = consistency
+
+        # transactions, and the edges of session order and write-read
+        self.nodes = [tx_id for transactions in self.db.sessions.values() for tx_id in transactions]
+        self.edges = {}
+        for transactions in self.db.sessions.values():
+            self.edges[(datastore.INIT_TX, transactions[0])] = True
+            for i in range(1, len(transactions)):
+                self.edges[(transactions[i - 1], transactions[i])] = True
+        self.edges.pop((datastore.INIT_TX, datastore.INIT_TX), None)
+
+        for read_history in self.db.read_history.values():
+            for r in read_history:
+                if r.write_tx != r.transaction:
+                    self.edges[(r.write_tx, r.transaction)] = True
+
+        # writers of every key as a bitset over the nodes
+        index = {tx_id: i for i, tx_id in enumerate(self.nodes)}
+        self.writers = {}
+        for k, write_history in self.db.write_history.items():
+            bits = 0
+            for w in write_history:
+                bits |= 1 << index[w.transaction]
+            self.writers[k] = bits
+
+        # (key, write, reader) of the reads from another transaction
+        self.reads = [(k, index[r.write_tx], index[r.transaction])
+                      for k, read_history in self.db.read_history.items()
+                      for r in read_history if r.write_tx != r.transaction]
+
+        # number of write-write orders left to the solver
+        self.ambiguous = 0
+
+    def closure(self, edges):
+        # what every node reaches and is reached from, None when the edges form a cycle
+        successors = graph.Reachability(self.nodes, edges)
+        if not successors.acyclic:
+            return None
+
+        predecessors = graph.Reachability(self.nodes, [(dst, src) for src, dst in edges])
+        return successors.reach, predecessors.reach
+
+    def causal_edges(self, before):
+        # causal arbitration: a write that happens before a read commits before the write the read reads from
+        edges = {}
+        for k, w, r in self.reads:
+            for c in _bits(self.writers[k] & before[r] & ~(1 << w)):
+                edges[(self.nodes[c], self.nodes[w])] = True
+
+        return edges
+
+    def read_committed_edges(self):
+        # a read commits its write after the writes that earlier reads of its transaction read from,
+        # when both transactions write the key of the read
+        writers = {k: {w.transaction for w in write_history} for k, write_history in self.db.write_history.items()}
+
+        tx_reads = {}
+        for read_history in self.db.read_history.values():
+            for r in read_history:
+                if r.transaction not in tx_reads:
+                    tx_reads[r.transaction] = []
+                tx_reads[r.transaction].append(r)
+
+        edges = {}
+        for reads in tx_reads.values():
+            reads.sort(key=lambda r: r.seq)
+            earlier = {}
+            for r1 in reads:
+                for t2 in earlier:
+                    if t2 != r1.write_tx and t2 in writers[r1.key]:
+                        edges[(t2, r1.write_tx)] = True
+                earlier[r1.write_tx] = True
+
+        return edges
+
+    def weak_check(self, hb):
+        if hb is None:
+            return unsat
+
+        if self.consistency == Consistency.Causal:
+            edges = self.causal_edges(hb[1])
+        else:
+            edges = self.read_committed_edges()
+        edges.update(self.edges)
+
+        return sat if graph.Reachability(self.nodes, edges).acyclic else unsat
+
+    def serializable_check(self, hb):
+        edges = dict(self.edges)
+        after, before = hb
+
+        # every other writer c of the key of a read commits before the write w it reads from, or after the reader r
+        constraints = [(w, r, self.writers[k] & ~((1 << w) | (1 << r))) for k, w, r in self.reads]
+
+        # orders whose alternative closes a cycle are forced, until no order is
+        while True:
+            pending = []
+            forced = False
+            for w, r, conflicts in constraints:
+                # already ordered either way
+                conflicts &= ~before[w] & ~after[r]
+                if not conflicts:
+                    continue
+
+                if conflicts & after[w] & before[r]:
+                    return unsat
+
+                for c in _bits(conflicts & before[r]):
+                    edges[(self.nodes[c], self.nodes[w])] = True
+                    forced = True
+                for c in _bits(conflicts & after[w]):
+                    edges[(self.nodes[r], self.nodes[c])] = True
+                    forced = True
+
+                conflicts &= ~(before[r] | after[w])
+                if conflicts:
+                    pending.append((w, r, conflicts))
+
+            constraints = pending
+            if not forced:
+                break
+
+            hb = self.closure(edges)
+            if hb is None:
+                return unsat
+            after, before = hb
+
+        constraints = [(c, w, r) for w, r, conflicts in constraints for c in _bits(conflicts)]
+        self.ambiguous = len(constraints)
+        if not constraints:
+            return sat
+
+        # the remaining orders are chosen by the solver, over the transactions they mention: any path between two
+        # of them through the others is one known order, and only orders not implied through a third are kept
+        involved = 0
+        for c, w, r in constraints:
+            involved |= (1 << c) | (1 << w) | (1 << r)
+
+        known = []
+        for a in _bits(involved):
+            reached = after[a] & involved
+            implied = 0
+            for b in _bits(reached):
+                implied |= after[b]
+            known.extend((a, b) for b in _bits(reached & ~implied))
+
+        s = Solver()
+        s.set("timeout", 1800000)
+        co = {i: Int("Serializable-CommitOrder[%s]"%self.nodes[i]) for i in _bits(involved)}
+        s.add([co[a] < co[b] for a, b in known])
+        s.add([Or(co[c] < co[w], co[r] < co[c]) for c, w, r in constraints])
+
+        return s.check()
+
+    def verify(self):
+        # happens-before is the transitive closure of the observed session order and write-read
+        hb = self.closure(self.edges)
+
+        res = self.weak_check(hb)
+        print("%s: %s"%(self.consistency, str(res)))
+        if res != sat:
+            return res
+
+        res = self.serializable_check(hb)
+        print("Serializable: %s"%(str(res)))
+
+        return res
+
+def _bits(bits):
+    # positions of the set bits
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low